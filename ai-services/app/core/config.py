@@ -2,119 +2,126 @@
 Configuration settings for Wyoiwyget AI Services
 """
 
-import os
-from typing import List, Optional
-from pydantic import BaseSettings, Field
+import json
+from functools import lru_cache
+from typing import Any, FrozenSet, Optional, Union
+from pydantic import Field, field_validator
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class Settings(BaseSettings):
     """Application settings"""
     
     # Environment
-    ENVIRONMENT: str = Field(default="development", env="ENVIRONMENT")
-    DEBUG: bool = Field(default=True, env="DEBUG")
+    ENVIRONMENT: str = Field(default="development")
+    DEBUG: bool = Field(default=True)
     
     # Server
-    HOST: str = Field(default="0.0.0.0", env="HOST")
-    PORT: int = Field(default=8001, env="PORT")
+    HOST: str = Field(default="0.0.0.0")
+    PORT: int = Field(default=8001)
     
     # Security
-    SECRET_KEY: str = Field(..., env="SECRET_KEY")
-    ALGORITHM: str = Field(default="HS256", env="ALGORITHM")
-    ACCESS_TOKEN_EXPIRE_MINUTES: int = Field(default=30, env="ACCESS_TOKEN_EXPIRE_MINUTES")
-    
-    # CORS
-    ALLOWED_ORIGINS: List[str] = Field(
-        default=["http://localhost:3000", "http://localhost:3001"],
-        env="ALLOWED_ORIGINS"
+    SECRET_KEY: str = Field(...)
+    ALGORITHM: str = Field(default="HS256")
+    ACCESS_TOKEN_EXPIRE_MINUTES: int = Field(default=30)
+    
+    # CORS; set-valued settings take a JSON list or a comma-separated string (the str
+    # member lets a non-JSON env value reach _split_csv instead of failing to decode)
+    ALLOWED_ORIGINS: Union[FrozenSet[str], str] = Field(
+        default=frozenset(["http://localhost:3000", "http://localhost:3001"])
     )
-    ALLOWED_HOSTS: List[str] = Field(
-        default=["localhost", "127.0.0.1"],
-        env="ALLOWED_HOSTS"
+    ALLOWED_HOSTS: Union[FrozenSet[str], str] = Field(
+        default=frozenset(["localhost", "127.0.0.1"])
     )
     
     # Database
-    DATABASE_URL: str = Field(..., env="DATABASE_URL")
+    DATABASE_URL: str = Field(...)
     
     # Azure Services
-    AZURE_STORAGE_CONNECTION_STRING: str = Field(..., env="AZURE_STORAGE_CONNECTION_STRING")
-    AZURE_STORAGE_CONTAINER_NAME: str = Field(default="wyoiwyget-assets", env="AZURE_STORAGE_CONTAINER_NAME")
+    AZURE_STORAGE_CONNECTION_STRING: str = Field(...)
+    AZURE_STORAGE_CONTAINER_NAME: str = Field(default="wyoiwyget-assets")
     
     # Azure AI Services
-    AZURE_OPENAI_API_KEY: str = Field(..., env="AZURE_OPENAI_API_KEY")
-    AZURE_OPENAI_ENDPOINT: str = Field(..., env="AZURE_OPENAI_ENDPOINT")
-    AZURE_OPENAI_API_VERSION: str = Field(default="2024-02-15-preview", env="AZURE_OPENAI_API_VERSION")
+    AZURE_OPENAI_API_KEY: str = Field(...)
+    AZURE_OPENAI_ENDPOINT: str = Field(...)
+    AZURE_OPENAI_API_VERSION: str = Field(default="2024-02-15-preview")
     
     # Azure Computer Vision
-    AZURE_COMPUTER_VISION_KEY: str = Field(..., env="AZURE_COMPUTER_VISION_KEY")
-    AZURE_COMPUTER_VISION_ENDPOINT: str = Field(..., env="AZURE_COMPUTER_VISION_ENDPOINT")
+    AZURE_COMPUTER_VISION_KEY: str = Field(...)
+    AZURE_COMPUTER_VISION_ENDPOINT: str = Field(...)
     
     # Azure Custom Vision
-    AZURE_CUSTOM_VISION_KEY: str = Field(..., env="AZURE_CUSTOM_VISION_KEY")
-    AZURE_CUSTOM_VISION_ENDPOINT: str = Field(..., env="AZURE_CUSTOM_VISION_ENDPOINT")
-    AZURE_CUSTOM_VISION_PROJECT_ID: str = Field(..., env="AZURE_CUSTOM_VISION_PROJECT_ID")
+    AZURE_CUSTOM_VISION_KEY: str = Field(...)
+    AZURE_CUSTOM_VISION_ENDPOINT: str = Field(...)
+    AZURE_CUSTOM_VISION_PROJECT_ID: str = Field(...)
     
     # Azure Form Recognizer
-    AZURE_FORM_RECOGNIZER_KEY: str = Field(..., env="AZURE_FORM_RECOGNIZER_KEY")
-    AZURE_FORM_RECOGNIZER_ENDPOINT: str = Field(..., env="AZURE_FORM_RECOGNIZER_ENDPOINT")
+    AZURE_FORM_RECOGNIZER_KEY: str = Field(...)
+    AZURE_FORM_RECOGNIZER_ENDPOINT: str = Field(...)
+    
+    # Azure Machine Learning endpoints
+    AZURE_ML_ENDPOINT: str = Field(...)
+    AZURE_ML_API_KEY: str = Field(...)
     
     # Azure Key Vault
-    AZURE_KEY_VAULT_URL: str = Field(..., env="AZURE_KEY_VAULT_URL")
+    AZURE_KEY_VAULT_URL: str = Field(...)
     
     # Redis (for caching and task queues)
-    REDIS_URL: str = Field(default="redis://localhost:6379", env="REDIS_URL")
+    REDIS_URL: str = Field(default="redis://localhost:6379")
     
     # Logging
-    LOG_LEVEL: str = Field(default="INFO", env="LOG_LEVEL")
-    LOG_FORMAT: str = Field(default="json", env="LOG_FORMAT")
+    LOG_LEVEL: str = Field(default="INFO")
+    LOG_FORMAT: str = Field(default="json")
     
     # File Upload
-    MAX_FILE_SIZE: int = Field(default=10 * 1024 * 1024, env="MAX_FILE_SIZE")  # 10MB
-    ALLOWED_IMAGE_TYPES: List[str] = Field(
-        default=["image/jpeg", "image/png", "image/webp"],
-        env="ALLOWED_IMAGE_TYPES"
+    MAX_FILE_SIZE: int = Field(default=10 * 1024 * 1024)  # 10MB
+    ALLOWED_IMAGE_TYPES: Union[FrozenSet[str], str] = Field(
+        default=frozenset(["image/jpeg", "image/png", "image/webp"])
     )
     
     # AI Model Settings
-    AVATAR_GENERATION_MODEL: str = Field(default="dall-e-3", env="AVATAR_GENERATION_MODEL")
-    VIRTUAL_TRYON_MODEL: str = Field(default="stable-diffusion-xl", env="VIRTUAL_TRYON_MODEL")
-    BODY_MEASUREMENT_MODEL: str = Field(default="yolov8-pose", env="BODY_MEASUREMENT_MODEL")
+    AVATAR_GENERATION_MODEL: str = Field(default="dall-e-3")
+    VIRTUAL_TRYON_MODEL: str = Field(default="stable-diffusion-xl")
+    BODY_MEASUREMENT_MODEL: str = Field(default="yolov8-pose")
+    
+    # Local ONNX feature models (avatar face/body application is skipped when unset)
+    AVATAR_FACE_MODEL_PATH: Optional[str] = Field(default=None)
+    AVATAR_BODY_MODEL_PATH: Optional[str] = Field(default=None)
+    ONNX_USE_GPU: bool = Field(default=True)
+    ONNX_PREFER_INT8: bool = Field(default=True)
     
     # Processing Settings
-    MAX_CONCURRENT_TASKS: int = Field(default=5, env="MAX_CONCURRENT_TASKS")
-    TASK_TIMEOUT_SECONDS: int = Field(default=300, env="TASK_TIMEOUT_SECONDS")
+    MAX_CONCURRENT_TASKS: int = Field(default=5)
+    TRYON_QUEUE_SIZE: int = Field(default=100)
+    MAX_INFLIGHT_REQUESTS: int = Field(default=64)
+    TASK_TIMEOUT_SECONDS: int = Field(default=300)
+    PROGRESS_FLUSH_INTERVAL_MS: int = Field(default=100)
+    MATCH_SAVE_FLUSH_INTERVAL_MS: int = Field(default=50)
+    MATCH_SAVE_BATCH_SIZE: int = Field(default=100)
     
     # External APIs
-    OPENAI_API_KEY: Optional[str] = Field(default=None, env="OPENAI_API_KEY")
-    REPLICATE_API_TOKEN: Optional[str] = Field(default=None, env="REPLICATE_API_TOKEN")
-    
-    class Config:
-        env_file = ".env"
-        case_sensitive = True
+    OPENAI_API_KEY: Optional[str] = Field(default=None)
+    REPLICATE_API_TOKEN: Optional[str] = Field(default=None)
+    
+    model_config = SettingsConfigDict(env_file=".env", case_sensitive=True)
+    
+    @field_validator("ALLOWED_ORIGINS", "ALLOWED_HOSTS", "ALLOWED_IMAGE_TYPES", mode="before")
+    @classmethod
+    def _split_csv(cls, value: Any) -> Any:
+        """Turn a comma-separated or JSON list string into a frozenset"""
+        if isinstance(value, str):
+            value = value.strip()
+            if value.startswith("["):
+                return frozenset(json.loads(value))
+            return frozenset(item.strip() for item in value.split(",") if item.strip())
+        return value
 
 
-# Create settings instance
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Return the process-wide settings, validated once on first use"""
+    return Settings()
 
-# Validate required settings
-def validate_settings():
-    """Validate that all required settings are present"""
-    required_settings = [
-        "SECRET_KEY",
-        "DATABASE_URL",
-        "AZURE_STORAGE_CONNECTION_STRING",
-        "AZURE_OPENAI_API_KEY",
-        "AZURE_OPENAI_ENDPOINT",
-    ]
-    
-    missing_settings = []
-    for setting in required_settings:
-        if not getattr(settings, setting, None):
-            missing_settings.append(setting)
-    
-    if missing_settings:
-        raise ValueError(f"Missing required settings: {', '.join(missing_settings)}")
 
-# Validate settings on import
-if settings.ENVIRONMENT != "test":
-    validate_settings() 
\ No newline at end of file
+# Create settings instance
+settings = get_settings()
@@ -0,0 +1,24 @@
+"""
+Avatar generation task models
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+
+@dataclass(slots=True)
+class AvatarTask:
+    """Avatar generation task record"""
+    id: str
+    user_id: str
+    status: str = 'processing'
+    progress: int = 0
+    message: str = ''
+    created_at_ts: float = 0.0
+    created_at_iso: str = ''
+    body_measurements: Dict[str, Any] = field(default_factory=dict)
+    face_image_url: Optional[str] = None
+    body_image_url: Optional[str] = None
+    preferences: Dict[str, Any] = field(default_factory=dict)
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
@@ -0,0 +1,17 @@
+"""
+Compiled numeric kernels for body measurement math
+"""
+
+from numba import njit
+
+
+@njit(cache=True)
+def bmi_bucket(height_cm: float, weight_kg: float) -> int:
+    """Return the BMI class index: 0 under 18.5, 1 under 25, 2 under 30, 3 otherwise"""
+    height_m = height_cm * 0.01
+    bmi = weight_kg / (height_m * height_m)
+    return (bmi >= 18.5) + (bmi >= 25.0) + (bmi >= 30.0)
+
+
+# Compile on import so the first request does not pay for JIT compilation
+bmi_bucket(170.0, 70.0)
@@ -0,0 +1,60 @@
+"""
+Compiled kernels for product text similarity
+"""
+
+from typing import Iterable, Optional, Tuple
+import numpy as np
+from numba import njit
+
+
+def token_hashes(text: Optional[str]) -> np.ndarray:
+    """Return the sorted, unique hashes of a text's lowercased whitespace-separated words"""
+    if not text:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.fromiter(map(hash, text.lower().split()), dtype=np.int64))
+
+
+def pack_token_hashes(texts: Iterable[Optional[str]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Concatenate per-text token hashes into a flat array plus (n + 1) offsets"""
+    arrays = [token_hashes(text) for text in texts]
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    np.cumsum([len(a) for a in arrays], out=offsets[1:])
+    flat = np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64)
+    return flat, offsets
+
+
+@njit(cache=True)
+def jaccard_many(source: np.ndarray, flat: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Jaccard similarity of one sorted token set against many packed sorted token sets
+
+    Each candidate ``i`` is ``flat[offsets[i]:offsets[i + 1]]``; the intersection
+    is counted with a merge over both sorted arrays. Empty sets score 0.0.
+    """
+    n = offsets.shape[0] - 1
+    result = np.zeros(n, dtype=np.float64)
+    m = source.shape[0]
+    if m == 0:
+        return result
+    for i in range(n):
+        start = offsets[i]
+        end = offsets[i + 1]
+        if start == end:
+            continue
+        a = 0
+        b = start
+        common = 0
+        while a < m and b < end:
+            if source[a] == flat[b]:
+                common += 1
+                a += 1
+                b += 1
+            elif source[a] < flat[b]:
+                a += 1
+            else:
+                b += 1
+        result[i] = common / (m + (end - start) - common)
+    return result
+
+
+# Compile on import so the first request does not pay for JIT compilation
+jaccard_many(np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64), np.array([0, 1], dtype=np.int64))
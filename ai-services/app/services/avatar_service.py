@@ -4,22 +4,112 @@ Handles AI-powered avatar creation using Azure AI services
 """
 
 import asyncio
+import hashlib
+import json
+from dataclasses import asdict, fields
+import textwrap
 import uuid
 import time
-from typing import Dict, Any, Optional, List
-from datetime import datetime
-import aiohttp
+from typing import Dict, Any, Optional, List, Tuple, Union, AsyncIterable
+from datetime import datetime, timedelta
+import httpx
+import redis.asyncio as redis
 import structlog
 from azure.ai.openai import AsyncOpenAIClient
 from azure.core.credentials import AzureKeyCredential
 from azure.storage.blob.aio import BlobServiceClient
-from azure.storage.blob import ContentSettings
+from azure.storage.blob import BlobBlock, ContentSettings, ContainerSasPermissions, generate_container_sas
 
 from app.core.config import settings
+from app.models.avatar import AvatarTask
+from app.services._body_math import bmi_bucket
 from app.utils.logging import log_ai_task_start, log_ai_task_complete, log_ai_task_error
+from app.utils.onnx_models import create_session, run_image_model
 
 logger = structlog.get_logger()
 
+# Base avatar prompt, parsed once at import and filled per request
+_BASE_AVATAR_PROMPT = textwrap.dedent("""
+    Create a realistic, full-body portrait of a {gender} person with the following characteristics:
+    
+    Body: {body_description}, {height}cm tall, {weight}kg
+    Style: {style} clothing, modern and fashionable
+    Hair: {hair_style} {hair_color} hair
+    Eyes: {eye_color} eyes
+    Skin: {skin_tone} skin tone
+    
+    The person should be standing in a natural pose, facing slightly to the side,
+    with good lighting and high-quality details. The image should be suitable
+    for virtual try-on applications.
+    
+    Style: Photorealistic, high resolution, professional photography style,
+    neutral background, full body shot, front-facing pose.
+""").strip().format_map
+
+# Redis layout: one hash per task, a per-user task set and a creation-time index
+_TASK_KEY = "avatar_task:{}"
+_USER_TASKS_KEY = "avatar_user_tasks:{}"
+_TASKS_BY_TIME_KEY = "avatar_tasks_by_time"
+_TASK_UPDATES_CHANNEL = "task_updates"
+
+# Late writes from a running generation must not recreate a task deleted meanwhile
+_HSET_IF_EXISTS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV))
+return 1
+"""
+
+# A flushed progress update lands only while the task is still processing and
+# only moves progress forward, so a delayed flush cannot overwrite the final state
+_SET_PROGRESS_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'status') ~= 'processing' then
+    return 0
+end
+if (tonumber(redis.call('HGET', KEYS[1], 'progress')) or 0) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'progress', ARGV[1], 'message', ARGV[2])
+return 1
+"""
+_PROMPT_CACHE_KEY = "avatar_prompt:{}"
+_PROMPT_CACHE_TTL_SECONDS = 7 * 24 * 3600
+
+# Image generation parameters; they are part of the prompt cache key
+_IMAGE_MODEL = "dall-e-3"
+_IMAGE_SIZE = "1024x1024"
+_IMAGE_QUALITY = "standard"
+
+# Task fields stored as JSON inside the task hash
+_JSON_FIELDS = ('body_measurements', 'preferences', 'result')
+_TASK_FIELDS = frozenset(f.name for f in fields(AvatarTask))
+
+# Read-only container SAS lifetime and how often it is re-signed
+_SAS_TTL = timedelta(hours=1)
+_SAS_REFRESH_SECONDS = 50 * 60
+
+# Chunk size used when piping generated images into blob storage
+_STREAM_CHUNK_SIZE = 256 * 1024
+
+# Blob upload tuning: larger single puts, then parallel staged blocks
+_MAX_SINGLE_PUT_SIZE = 8 * 1024 * 1024
+_UPLOAD_BLOCK_SIZE = 4 * 1024 * 1024
+_UPLOAD_CONCURRENCY = 4
+
+_AVATAR_CONTENT_SETTINGS = ContentSettings(
+    content_type="image/png",
+    cache_control="public, max-age=31536000"
+)
+
+# Body description for each BMI bucket returned by bmi_bucket()
+_BMI_LABELS = (
+    "slim and slender",
+    "average and well-proportioned",
+    "athletic and toned",
+    "full-figured and curvy",
+)
+
 
 class AvatarService:
     """Service for generating AI-powered avatars"""
@@ -31,14 +121,64 @@ class AvatarService:
             api_version=settings.AZURE_OPENAI_API_VERSION
         )
         self.blob_service_client = BlobServiceClient.from_connection_string(
-            settings.AZURE_STORAGE_CONNECTION_STRING
+            settings.AZURE_STORAGE_CONNECTION_STRING,
+            max_single_put_size=_MAX_SINGLE_PUT_SIZE,
+            max_block_size=_UPLOAD_BLOCK_SIZE
         )
         self.container_client = self.blob_service_client.get_container_client(
             settings.AZURE_STORAGE_CONTAINER_NAME
         )
         
-        # Task storage (in production, use Redis or database)
-        self.active_tasks: Dict[str, Dict[str, Any]] = {}
+        # Container-level SAS reused for every avatar URL; signed by the refresher
+        self._sas_token = ""
+        credential = self.blob_service_client.credential
+        if not hasattr(credential, "account_key") and not hasattr(credential, "get_token"):
+            if "?" not in self.container_client.url:
+                logger.error("Storage credential cannot sign SAS tokens, avatar URLs will be unsigned")
+        self._sas_refresher_task = asyncio.create_task(self._sas_refresher())
+        
+        # Feature models are loaded once per process when configured
+        self._face_session = (
+            create_session(settings.AVATAR_FACE_MODEL_PATH, settings.ONNX_USE_GPU, settings.ONNX_PREFER_INT8)
+            if settings.AVATAR_FACE_MODEL_PATH else None
+        )
+        self._body_session = (
+            create_session(settings.AVATAR_BODY_MODEL_PATH, settings.ONNX_USE_GPU, settings.ONNX_PREFER_INT8)
+            if settings.AVATAR_BODY_MODEL_PATH else None
+        )
+        
+        # Shared HTTP/2 client so image downloads multiplex over pooled connections
+        self._http = httpx.AsyncClient(
+            http2=True,
+            timeout=30,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=settings.MAX_CONCURRENT_TASKS * 20,
+                max_keepalive_connections=settings.MAX_CONCURRENT_TASKS * 4,
+                keepalive_expiry=60
+            )
+        )
+        
+        # Task state lives in Redis so any worker replica can serve status calls
+        self.redis = redis.from_url(settings.REDIS_URL, decode_responses=True)
+        self._hset_if_exists = self.redis.register_script(_HSET_IF_EXISTS_SCRIPT)
+        self._set_progress = self.redis.register_script(_SET_PROGRESS_SCRIPT)
+        
+        # Tasks currently being generated by this worker
+        self.active_tasks: Dict[str, AvatarTask] = {}
+        
+        # Latest progress per task, coalesced and flushed to Redis periodically
+        self._pending_progress: Dict[str, Tuple[int, str]] = {}
+        self._progress_flusher_task = asyncio.create_task(self._progress_flusher())
+    
+    async def aclose(self):
+        """Release pooled HTTP connections, Redis and Azure clients"""
+        self._progress_flusher_task.cancel()
+        self._sas_refresher_task.cancel()
+        await self._flush_progress()
+        await self._http.aclose()
+        await self.redis.aclose()
+        await self.blob_service_client.close()
     
     async def start_generation(
         self,
@@ -49,23 +189,28 @@ class AvatarService:
         preferences: Optional[Dict[str, Any]] = None
     ) -> str:
         """Start avatar generation process"""
-        task_id = str(uuid.uuid4())
-        
-        task_data = {
-            'id': task_id,
-            'user_id': user_id,
-            'status': 'processing',
-            'progress': 0,
-            'created_at': datetime.utcnow(),
-            'body_measurements': body_measurements,
-            'face_image_url': face_image_url,
-            'body_image_url': body_image_url,
-            'preferences': preferences or {},
-            'result': None,
-            'error': None,
-        }
+        task_id = uuid.uuid4().hex
+        
+        # Epoch and ISO forms are fixed at creation so reads never re-format them
+        created_at_ts = time.time()
+        task = AvatarTask(
+            id=task_id,
+            user_id=user_id,
+            created_at_ts=created_at_ts,
+            created_at_iso=datetime.utcfromtimestamp(created_at_ts).isoformat(),
+            body_measurements=body_measurements,
+            face_image_url=face_image_url,
+            body_image_url=body_image_url,
+            preferences=preferences or {},
+        )
         
-        self.active_tasks[task_id] = task_data
+        self.active_tasks[task_id] = task
+        
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(_TASK_KEY.format(task_id), mapping=self._encode_task(asdict(task)))
+            pipe.sadd(_USER_TASKS_KEY.format(user_id), task_id)
+            pipe.zadd(_TASKS_BY_TIME_KEY, {task_id: created_at_ts})
+            await pipe.execute()
         
         # Start generation in background
         asyncio.create_task(self._generate_avatar(task_id))
@@ -77,58 +222,83 @@ class AvatarService:
     async def _generate_avatar(self, task_id: str):
         """Generate avatar in background"""
         task = self.active_tasks[task_id]
-        user_id = task['user_id']
+        user_id = task.user_id
         
         try:
             start_time = time.time()
             
             # Step 1: Analyze body measurements and create base avatar (20%)
-            await self._update_task_progress(task_id, 20, "Analyzing body measurements...")
+            self._update_task_progress(task_id, 20, "Analyzing body measurements...")
             base_avatar_prompt = await self._create_base_avatar_prompt(
-                task['body_measurements'],
-                task['preferences']
+                task.body_measurements,
+                task.preferences
             )
             
-            # Step 2: Generate base avatar image (40%)
-            await self._update_task_progress(task_id, 40, "Generating base avatar...")
-            base_avatar_image = await self._generate_avatar_image(base_avatar_prompt)
-            
-            # Step 3: Apply face features if provided (60%)
-            if task['face_image_url']:
-                await self._update_task_progress(task_id, 60, "Applying face features...")
-                avatar_with_face = await self._apply_face_features(
-                    base_avatar_image,
-                    task['face_image_url']
+            # Step 2: Generate base avatar while fetching reference images (40%)
+            self._update_task_progress(task_id, 40, "Generating base avatar...")
+            if task.face_image_url or task.body_image_url:
+                base_image, face_image, body_image = await asyncio.gather(
+                    self._generate_avatar_image(base_avatar_prompt),
+                    self._download_optional(task.face_image_url, "face"),
+                    self._download_optional(task.body_image_url, "body"),
+                    return_exceptions=True
                 )
+                if isinstance(base_image, BaseException):
+                    raise base_image
             else:
-                avatar_with_face = base_avatar_image
+                # Nothing to fetch alongside generation, so skip the gather and its extra tasks
+                base_image = await self._generate_avatar_image(base_avatar_prompt)
+                face_image = body_image = None
+            base_image_url, from_cache = base_image
+            
+            # Feature application works on the full image, so only buffer it when needed
+            final_avatar = None
+            if face_image or body_image:
+                final_avatar = await self._download(base_image_url, "generated")
+            
+            # Step 3: Apply face features if provided (60%)
+            if face_image:
+                self._update_task_progress(task_id, 60, "Applying face features...")
+                final_avatar = await self._apply_face_features(final_avatar, face_image)
             
             # Step 4: Apply body features if provided (80%)
-            if task['body_image_url']:
-                await self._update_task_progress(task_id, 80, "Applying body features...")
+            if body_image:
+                self._update_task_progress(task_id, 80, "Applying body features...")
                 final_avatar = await self._apply_body_features(
-                    avatar_with_face,
-                    task['body_image_url'],
-                    task['body_measurements']
+                    final_avatar,
+                    body_image,
+                    task.body_measurements
                 )
-            else:
-                final_avatar = avatar_with_face
             
             # Step 5: Upload to Azure Storage (90%)
-            await self._update_task_progress(task_id, 90, "Saving avatar...")
-            avatar_url = await self._upload_avatar(final_avatar, task_id)
+            self._update_task_progress(task_id, 90, "Saving avatar...")
+            if final_avatar is not None:
+                avatar_url = await self._upload_avatar(final_avatar, task_id)
+            elif from_cache:
+                avatar_url = await self._copy_avatar(base_image_url, task_id)
+            else:
+                avatar_url = await self._stream_avatar_upload(base_image_url, task_id)
+                await self.redis.set(
+                    self._prompt_cache_key(base_avatar_prompt),
+                    self._avatar_blob_name(task_id),
+                    ex=_PROMPT_CACHE_TTL_SECONDS
+                )
             
             # Step 6: Complete (100%)
-            await self._update_task_progress(task_id, 100, "Avatar generation complete!")
+            self._update_task_progress(task_id, 100, "Avatar generation complete!")
             
             # Update task with result
-            task['status'] = 'completed'
-            task['result'] = {
+            task.status = 'completed'
+            task.result = {
                 'avatar_url': avatar_url,
                 'generated_at': datetime.utcnow().isoformat(),
-                'preferences': task['preferences'],
-                'body_measurements': task['body_measurements'],
+                'preferences': task.preferences,
+                'body_measurements': task.body_measurements,
             }
+            await self._write_task_fields(task_id, {
+                **self._take_pending_progress(task_id),
+                **self._encode_task({'status': task.status, 'result': task.result}),
+            })
             
             duration = time.time() - start_time
             log_ai_task_complete('avatar_generation', task_id, user_id, duration)
@@ -139,10 +309,18 @@ class AvatarService:
                         user_id=user_id, 
                         error=str(e))
             
-            task['status'] = 'failed'
-            task['error'] = str(e)
+            task.status = 'failed'
+            task.error = str(e)
+            await self._write_task_fields(task_id, {
+                **self._take_pending_progress(task_id),
+                'status': task.status,
+                'error': task.error,
+            })
             
             log_ai_task_error('avatar_generation', task_id, user_id, e)
+        
+        finally:
+            self.active_tasks.pop(task_id, None)
     
     async def _create_base_avatar_prompt(
         self,
@@ -154,88 +332,89 @@ class AvatarService:
         # Extract measurements
         height = body_measurements.get('height', 170)
         weight = body_measurements.get('weight', 70)
-        body_type = body_measurements.get('body_type', 'average')
-        gender = body_measurements.get('gender', 'other')
-        
-        # Extract preferences
-        style = preferences.get('style', 'casual')
-        hair_style = preferences.get('hairStyle', 'natural')
-        skin_tone = preferences.get('skinTone', 'medium')
-        eye_color = preferences.get('eyeColor', 'brown')
-        hair_color = preferences.get('hairColor', 'brown')
-        
-        # Calculate BMI for body proportions
-        height_m = height / 100
-        bmi = weight / (height_m * height_m)
-        
-        # Determine body proportions based on BMI
-        if bmi < 18.5:
-            body_description = "slim and slender"
-        elif bmi < 25:
-            body_description = "average and well-proportioned"
-        elif bmi < 30:
-            body_description = "athletic and toned"
-        else:
-            body_description = "full-figured and curvy"
-        
-        # Create detailed prompt
-        prompt = f"""
-        Create a realistic, full-body portrait of a {gender} person with the following characteristics:
         
-        Body: {body_description}, {height}cm tall, {weight}kg
-        Style: {style} clothing, modern and fashionable
-        Hair: {hair_style} {hair_color} hair
-        Eyes: {eye_color} eyes
-        Skin: {skin_tone} skin tone
-        
-        The person should be standing in a natural pose, facing slightly to the side,
-        with good lighting and high-quality details. The image should be suitable
-        for virtual try-on applications.
+        return _BASE_AVATAR_PROMPT({
+            'gender': body_measurements.get('gender', 'other'),
+            'body_description': _BMI_LABELS[bmi_bucket(height, weight)],
+            'height': height,
+            'weight': weight,
+            'style': preferences.get('style', 'casual'),
+            'hair_style': preferences.get('hairStyle', 'natural'),
+            'hair_color': preferences.get('hairColor', 'brown'),
+            'eye_color': preferences.get('eyeColor', 'brown'),
+            'skin_tone': preferences.get('skinTone', 'medium'),
+        })
+    
+    async def _generate_avatar_image(self, prompt: str) -> Tuple[str, bool]:
+        """Generate avatar image using Azure OpenAI DALL-E and return its URL
         
-        Style: Photorealistic, high resolution, professional photography style,
-        neutral background, full body shot, front-facing pose.
+        Identical prompts reuse a previously stored avatar; the returned flag
+        is True when the URL points at that cached blob.
         """
-        
-        return prompt.strip()
-    
-    async def _generate_avatar_image(self, prompt: str) -> bytes:
-        """Generate avatar image using Azure OpenAI DALL-E"""
         try:
+            cache_key = self._prompt_cache_key(prompt)
+            cached_blob_name = await self.redis.get(cache_key)
+            if cached_blob_name:
+                cached_blob = self.container_client.get_blob_client(cached_blob_name)
+                if await cached_blob.exists():
+                    return self._signed_url(cached_blob.url), True
+                await self.redis.delete(cache_key)
+            
             response = await self.openai_client.images.generate(
-                model="dall-e-3",
+                model=_IMAGE_MODEL,
                 prompt=prompt,
-                size="1024x1024",
-                quality="standard",
+                size=_IMAGE_SIZE,
+                quality=_IMAGE_QUALITY,
                 n=1,
             )
             
-            # Download the generated image
-            image_url = response.data[0].url
-            async with aiohttp.ClientSession() as session:
-                async with session.get(image_url) as resp:
-                    if resp.status == 200:
-                        return await resp.read()
-                    else:
-                        raise Exception(f"Failed to download generated image: {resp.status}")
-                        
+            return response.data[0].url, False
+            
         except Exception as e:
             logger.error("Failed to generate avatar image", error=str(e))
             raise Exception(f"Avatar image generation failed: {str(e)}")
     
-    async def _apply_face_features(self, base_image: bytes, face_image_url: str) -> bytes:
+    @staticmethod
+    def _prompt_cache_key(prompt: str) -> str:
+        """Build the Redis key identifying a generation request"""
+        digest = hashlib.blake2b(digest_size=16)
+        for part in (prompt, _IMAGE_MODEL, _IMAGE_SIZE, _IMAGE_QUALITY):
+            digest.update(part.encode())
+            digest.update(b"\0")
+        return _PROMPT_CACHE_KEY.format(digest.hexdigest())
+    
+    @staticmethod
+    def _avatar_blob_name(task_id: str) -> str:
+        """Return the blob path of a task's avatar image"""
+        return f"avatars/{task_id}/avatar.png"
+    
+    async def _download(self, url: str, kind: str) -> bytes:
+        """Download an image using the shared HTTP session"""
+        resp = await self._http.get(url)
+        if resp.status_code != 200:
+            raise Exception(f"Failed to download {kind} image: {resp.status_code}")
+        return resp.content
+    
+    async def _download_optional(self, url: Optional[str], kind: str) -> Optional[bytes]:
+        """Download a reference image, returning None if absent or unavailable"""
+        if not url:
+            return None
+        try:
+            return await self._download(url, kind)
+        except Exception as e:
+            logger.error(f"Failed to download {kind} image", error=str(e))
+            return None
+    
+    async def _apply_face_features(self, base_image: bytes, face_image: bytes) -> bytes:
         """Apply face features from uploaded image to base avatar"""
         try:
-            # Download face image
-            async with aiohttp.ClientSession() as session:
-                async with session.get(face_image_url) as resp:
-                    if resp.status != 200:
-                        raise Exception(f"Failed to download face image: {resp.status}")
-                    face_image = await resp.read()
+            if self._face_session is None:
+                logger.info("Face feature model not configured")
+                return base_image
             
-            # TODO: Implement face swapping/merging using Azure Computer Vision
-            # For now, return the base image
-            logger.info("Face features application not yet implemented")
-            return base_image
+            return await asyncio.to_thread(
+                run_image_model, self._face_session, (base_image, face_image)
+            )
             
         except Exception as e:
             logger.error("Failed to apply face features", error=str(e))
@@ -245,118 +424,285 @@ class AvatarService:
     async def _apply_body_features(
         self,
         avatar_image: bytes,
-        body_image_url: str,
+        body_image: bytes,
         body_measurements: Dict[str, Any]
     ) -> bytes:
         """Apply body features from uploaded image"""
         try:
-            # Download body image
-            async with aiohttp.ClientSession() as session:
-                async with session.get(body_image_url) as resp:
-                    if resp.status != 200:
-                        raise Exception(f"Failed to download body image: {resp.status}")
-                    body_image = await resp.read()
+            if self._body_session is None:
+                logger.info("Body feature model not configured")
+                return avatar_image
             
-            # TODO: Implement body feature extraction and application
-            # For now, return the avatar image
-            logger.info("Body features application not yet implemented")
-            return avatar_image
+            return await asyncio.to_thread(
+                run_image_model, self._body_session, (avatar_image, body_image)
+            )
             
         except Exception as e:
             logger.error("Failed to apply body features", error=str(e))
             # Return avatar image if body application fails
             return avatar_image
     
-    async def _upload_avatar(self, image_data: bytes, task_id: str) -> str:
+    async def _stream_avatar_upload(self, image_url: str, task_id: str) -> str:
+        """Pipe the generated image from its source URL into Azure Blob Storage"""
+        async with self._http.stream("GET", image_url) as resp:
+            if resp.status_code != 200:
+                raise Exception(f"Failed to download generated image: {resp.status_code}")
+            return await self._upload_avatar(resp.aiter_bytes(_STREAM_CHUNK_SIZE), task_id)
+    
+    async def _copy_avatar(self, source_url: str, task_id: str) -> str:
+        """Copy a previously generated avatar to this task server-side"""
+        try:
+            blob_client = self.container_client.get_blob_client(self._avatar_blob_name(task_id))
+            await blob_client.upload_blob_from_url(
+                source_url,
+                overwrite=True,
+                content_settings=_AVATAR_CONTENT_SETTINGS
+            )
+            return self._signed_url(blob_client.url)
+            
+        except Exception as e:
+            logger.error("Failed to copy cached avatar", task_id=task_id, error=str(e))
+            raise Exception(f"Avatar upload failed: {str(e)}")
+    
+    async def _upload_avatar(
+        self,
+        image_data: Union[bytes, AsyncIterable[bytes]],
+        task_id: str
+    ) -> str:
         """Upload generated avatar to Azure Blob Storage"""
         try:
-            blob_name = f"avatars/{task_id}/avatar.png"
-            blob_client = self.container_client.get_blob_client(blob_name)
+            blob_client = self.container_client.get_blob_client(self._avatar_blob_name(task_id))
             
             # Upload with proper content settings
-            await blob_client.upload_blob(
-                image_data,
-                overwrite=True,
-                content_settings=ContentSettings(
-                    content_type="image/png",
-                    cache_control="public, max-age=31536000"
+            if isinstance(image_data, bytes):
+                await blob_client.upload_blob(
+                    image_data,
+                    overwrite=True,
+                    max_concurrency=_UPLOAD_CONCURRENCY,
+                    content_settings=_AVATAR_CONTENT_SETTINGS
                 )
-            )
+            else:
+                await self._upload_stream(blob_client, image_data)
             
             # Return the public URL
-            return f"{blob_client.url}?sv=2020-08-04&ss=b&srt=sco&sp=rwdlacupitfx&se=2024-12-31T23:59:59Z&st=2024-01-01T00:00:00Z&spr=https&sig=placeholder"
+            return self._signed_url(blob_client.url)
             
         except Exception as e:
             logger.error("Failed to upload avatar", task_id=task_id, error=str(e))
             raise Exception(f"Avatar upload failed: {str(e)}")
     
-    async def _update_task_progress(self, task_id: str, progress: int, message: str):
-        """Update task progress"""
-        if task_id in self.active_tasks:
-            self.active_tasks[task_id]['progress'] = progress
-            self.active_tasks[task_id]['message'] = message
+    async def _upload_stream(self, blob_client, chunks: AsyncIterable[bytes]):
+        """Upload a streamed avatar, as a single Put Blob when it fits in _MAX_SINGLE_PUT_SIZE"""
+        chunk_iter = chunks.__aiter__()
+        buffer = bytearray()
+        async for chunk in chunk_iter:
+            buffer += chunk
+            if len(buffer) > _MAX_SINGLE_PUT_SIZE:
+                break
+        else:
+            # Typical avatars end here: one request instead of Put Block plus Put Block List
+            await blob_client.upload_blob(
+                bytes(buffer),
+                overwrite=True,
+                content_settings=_AVATAR_CONTENT_SETTINGS
+            )
+            return
+        
+        await self._upload_blocks(blob_client, buffer, chunk_iter)
+    
+    async def _upload_blocks(self, blob_client, buffer: bytearray, chunks: AsyncIterable[bytes]):
+        """Stage an already buffered prefix and the rest of a stream as parallel blocks, then commit them"""
+        semaphore = asyncio.Semaphore(_UPLOAD_CONCURRENCY)
+        block_ids: List[str] = []
+        staging = []
+        
+        async def stage(block_id: str, data: bytes):
+            try:
+                await blob_client.stage_block(block_id, data)
+            finally:
+                semaphore.release()
+        
+        async def schedule(data: bytes):
+            # Waiting for a free slot before reading on bounds the bytes held in memory
+            await semaphore.acquire()
+            block_id = f"{len(block_ids):08d}"
+            block_ids.append(block_id)
+            staging.append(asyncio.create_task(stage(block_id, data)))
+        
+        while len(buffer) >= _UPLOAD_BLOCK_SIZE:
+            await schedule(bytes(buffer[:_UPLOAD_BLOCK_SIZE]))
+            del buffer[:_UPLOAD_BLOCK_SIZE]
+        async for chunk in chunks:
+            buffer += chunk
+            while len(buffer) >= _UPLOAD_BLOCK_SIZE:
+                await schedule(bytes(buffer[:_UPLOAD_BLOCK_SIZE]))
+                del buffer[:_UPLOAD_BLOCK_SIZE]
+        if buffer:
+            await schedule(bytes(buffer))
+        
+        await asyncio.gather(*staging)
+        await blob_client.commit_block_list(
+            [BlobBlock(block_id=block_id) for block_id in block_ids],
+            content_settings=_AVATAR_CONTENT_SETTINGS
+        )
+    
+    async def _generate_sas_token(self) -> str:
+        """Sign a read-only SAS token for the avatar container
+        
+        Account keys sign directly and AAD credentials sign with a user
+        delegation key. Any other credential (a connection string SAS, which
+        blob URLs already carry) yields an empty token.
+        """
+        credential = self.blob_service_client.credential
+        start = datetime.utcnow()
+        expiry = start + _SAS_TTL
+        if hasattr(credential, "account_key"):
+            signing_key = {"account_key": credential.account_key}
+        elif hasattr(credential, "get_token"):
+            delegation_key = await self.blob_service_client.get_user_delegation_key(start, expiry)
+            signing_key = {"user_delegation_key": delegation_key}
+        else:
+            return ""
+        
+        return generate_container_sas(
+            account_name=self.blob_service_client.account_name,
+            container_name=settings.AZURE_STORAGE_CONTAINER_NAME,
+            permission=ContainerSasPermissions(read=True),
+            expiry=expiry,
+            **signing_key
+        )
+    
+    async def _sas_refresher(self):
+        """Sign the container SAS token now and re-sign it before it expires"""
+        while True:
+            try:
+                self._sas_token = await self._generate_sas_token()
+            except Exception as e:
+                logger.error("Failed to refresh avatar SAS token", error=str(e))
+            await asyncio.sleep(_SAS_REFRESH_SECONDS)
+    
+    def _signed_url(self, blob_url: str) -> str:
+        """Append the container SAS token to a blob URL, if there is one"""
+        if not self._sas_token:
+            return blob_url
+        return f"{blob_url}{'&' if '?' in blob_url else '?'}{self._sas_token}"
+    
+    def _update_task_progress(self, task_id: str, progress: int, message: str):
+        """Record task progress; only the latest value is written on the next flush"""
+        self._pending_progress[task_id] = (progress, message)
+    
+    def _take_pending_progress(self, task_id: str) -> Dict[str, Any]:
+        """Remove a task's unflushed progress and return it as hash fields"""
+        pending = self._pending_progress.pop(task_id, None)
+        if pending is None:
+            return {}
+        return {'progress': pending[0], 'message': pending[1]}
+    
+    async def _progress_flusher(self):
+        """Periodically write coalesced progress updates to Redis"""
+        interval = settings.PROGRESS_FLUSH_INTERVAL_MS / 1000
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._flush_progress()
+            except Exception as e:
+                logger.error("Failed to flush avatar progress", error=str(e))
+    
+    async def _flush_progress(self):
+        """Write all pending progress updates in a single pipeline"""
+        if not self._pending_progress:
+            return
+        pending, self._pending_progress = self._pending_progress, {}
+        
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for task_id, (progress, message) in pending.items():
+                await self._set_progress(keys=[_TASK_KEY.format(task_id)], args=[progress, message], client=pipe)
+                pipe.publish(
+                    _TASK_UPDATES_CHANNEL,
+                    json.dumps({'task_id': task_id, 'progress': progress, 'message': message})
+                )
+            await pipe.execute()
+        
+        for task_id, (progress, message) in pending.items():
             logger.info("Avatar generation progress", 
                        task_id=task_id, 
                        progress=progress, 
                        message=message)
     
+    async def _write_task_fields(self, task_id: str, fields: Dict[str, Any], client=None):
+        """Set fields on a task hash unless the task has been deleted"""
+        await self._hset_if_exists(
+            keys=[_TASK_KEY.format(task_id)],
+            args=[item for field in fields.items() for item in field],
+            client=client
+        )
+    
     async def get_status(self, task_id: str, user_id: str) -> Dict[str, Any]:
         """Get avatar generation status"""
-        if task_id not in self.active_tasks:
+        task = self._decode_task(await self.redis.hgetall(_TASK_KEY.format(task_id)))
+        if task is None:
             raise Exception("Task not found")
         
-        task = self.active_tasks[task_id]
-        
         # Verify user owns this task
-        if task['user_id'] != user_id:
+        if task.user_id != user_id:
             raise Exception("Not authorized to access this task")
         
         return {
             'task_id': task_id,
-            'status': task['status'],
-            'progress': task.get('progress', 0),
-            'message': task.get('message', ''),
-            'created_at': task['created_at'].isoformat(),
-            'result': task.get('result'),
-            'error': task.get('error'),
+            'status': task.status,
+            'progress': task.progress,
+            'message': task.message,
+            'created_at': task.created_at_iso,
+            'result': task.result,
+            'error': task.error,
         }
     
     async def list_user_avatars(self, user_id: str) -> List[Dict[str, Any]]:
         """List all avatars for a user"""
-        user_avatars = []
+        task_ids = await self.redis.smembers(_USER_TASKS_KEY.format(user_id))
+        
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for task_id in task_ids:
+                pipe.hgetall(_TASK_KEY.format(task_id))
+            raw_tasks = await pipe.execute()
         
-        for task_id, task in self.active_tasks.items():
-            if task['user_id'] == user_id and task['status'] == 'completed':
-                user_avatars.append({
-                    'id': task_id,
-                    'avatar_url': task['result']['avatar_url'],
-                    'created_at': task['created_at'].isoformat(),
-                    'preferences': task['result']['preferences'],
-                    'body_measurements': task['result']['body_measurements'],
-                })
+        completed = []
+        for raw in raw_tasks:
+            task = self._decode_task(raw)
+            if task and task.status == 'completed':
+                completed.append(task)
+        completed.sort(key=lambda t: t.created_at_ts, reverse=True)
         
-        return sorted(user_avatars, key=lambda x: x['created_at'], reverse=True)
+        return [
+            {
+                'id': task.id,
+                'avatar_url': task.result['avatar_url'],
+                'created_at': task.created_at_iso,
+                'preferences': task.result['preferences'],
+                'body_measurements': task.result['body_measurements'],
+            }
+            for task in completed
+        ]
     
     async def delete_avatar(self, task_id: str, user_id: str) -> bool:
         """Delete an avatar"""
-        if task_id not in self.active_tasks:
+        task = self._decode_task(await self.redis.hgetall(_TASK_KEY.format(task_id)))
+        if task is None:
             raise Exception("Avatar not found")
         
-        task = self.active_tasks[task_id]
-        
         # Verify user owns this avatar
-        if task['user_id'] != user_id:
+        if task.user_id != user_id:
             raise Exception("Not authorized to delete this avatar")
         
         try:
             # Delete from blob storage
-            if task['status'] == 'completed' and task['result']:
-                blob_name = f"avatars/{task_id}/avatar.png"
-                blob_client = self.container_client.get_blob_client(blob_name)
-                await blob_client.delete_blob()
+            if task.status == 'completed' and task.result:
+                await self._delete_blob(task_id)
             
-            # Remove from active tasks
-            del self.active_tasks[task_id]
+            # Remove task state
+            async with self.redis.pipeline(transaction=False) as pipe:
+                self._queue_task_removal(pipe, task_id, user_id)
+                await pipe.execute()
             
             logger.info("Avatar deleted", task_id=task_id, user_id=user_id)
             return True
@@ -367,15 +713,82 @@ class AvatarService:
     
     async def cleanup_old_tasks(self, max_age_hours: int = 24):
         """Clean up old completed/failed tasks"""
-        cutoff_time = datetime.utcnow().timestamp() - (max_age_hours * 3600)
+        cutoff_time = time.time() - (max_age_hours * 3600)
+        
+        # Only the expired range of the creation-time index is visited
+        tasks_to_remove = await self.redis.zrangebyscore(_TASKS_BY_TIME_KEY, 0, cutoff_time)
+        if not tasks_to_remove:
+            return
+        
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for task_id in tasks_to_remove:
+                pipe.hmget(_TASK_KEY.format(task_id), 'user_id', 'status')
+            task_fields = await pipe.execute()
+        
+        # Delete stored avatars in parallel, bounded to avoid flooding the storage account
+        semaphore = asyncio.Semaphore(settings.MAX_CONCURRENT_TASKS)
+        
+        async def delete_one(task_id: str):
+            async with semaphore:
+                await self._delete_blob(task_id)
         
-        tasks_to_remove = []
-        for task_id, task in self.active_tasks.items():
-            if task['created_at'].timestamp() < cutoff_time:
-                tasks_to_remove.append(task_id)
+        results = await asyncio.gather(
+            *(
+                delete_one(task_id)
+                for task_id, (_, status) in zip(tasks_to_remove, task_fields)
+                if status == 'completed'
+            ),
+            return_exceptions=True
+        )
+        failed = sum(isinstance(result, Exception) for result in results)
+        if failed:
+            logger.warning("Failed to delete some avatar blobs", count=failed)
         
-        for task_id in tasks_to_remove:
-            del self.active_tasks[task_id]
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for task_id, (owner, _) in zip(tasks_to_remove, task_fields):
+                self._queue_task_removal(pipe, task_id, owner)
+            await pipe.execute()
         
-        if tasks_to_remove:
-            logger.info("Cleaned up old tasks", count=len(tasks_to_remove)) 
\ No newline at end of file
+        logger.info("Cleaned up old tasks", count=len(tasks_to_remove))
+    
+    async def _delete_blob(self, task_id: str):
+        """Delete a task's stored avatar image"""
+        blob_client = self.container_client.get_blob_client(self._avatar_blob_name(task_id))
+        await blob_client.delete_blob()
+    
+    def _queue_task_removal(self, pipe, task_id: str, user_id: Optional[str]):
+        """Queue deletion of a task hash and its index entries on a pipeline"""
+        pipe.delete(_TASK_KEY.format(task_id))
+        pipe.zrem(_TASKS_BY_TIME_KEY, task_id)
+        if user_id:
+            pipe.srem(_USER_TASKS_KEY.format(user_id), task_id)
+    
+    @staticmethod
+    def _encode_task(task: Dict[str, Any]) -> Dict[str, Any]:
+        """Flatten a task record into Redis hash fields"""
+        encoded = {}
+        for key, value in task.items():
+            if key in _JSON_FIELDS:
+                encoded[key] = json.dumps(value)
+            elif value is None:
+                encoded[key] = ''
+            else:
+                encoded[key] = value
+        return encoded
+    
+    @staticmethod
+    def _decode_task(raw: Dict[str, str]) -> Optional[AvatarTask]:
+        """Rebuild a task record from Redis hash fields"""
+        if not raw:
+            return None
+        values: Dict[str, Any] = {
+            key: (value or None) for key, value in raw.items() if key in _TASK_FIELDS
+        }
+        for key in _JSON_FIELDS:
+            if values.get(key):
+                values[key] = json.loads(values[key])
+        values['progress'] = int(raw.get('progress') or 0)
+        values['created_at_ts'] = float(raw.get('created_at_ts') or 0)
+        values['created_at_iso'] = raw.get('created_at_iso', '')
+        values['message'] = raw.get('message', '')
+        return AvatarTask(**values)
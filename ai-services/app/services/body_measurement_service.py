@@ -4,14 +4,26 @@ Handles body measurement analysis using computer vision
 """
 
 import asyncio
+import binascii
 import logging
+import os
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, Any, Optional, List
-import json
+from types import MappingProxyType
+from typing import Dict, Any, Optional, List, Tuple
 import aiohttp
+import orjson
+import redis.asyncio as redis
 import structlog
-from PIL import Image
+from PIL import Image, ImageFile
+from tenacity import (
+    AsyncRetrying,
+    retry_if_exception_type,
+    retry_if_result,
+    stop_after_attempt,
+    wait_random_exponential,
+)
 import io
 import numpy as np
 
@@ -22,12 +34,135 @@ from app.core.database import get_database
 
 logger = structlog.get_logger()
 
+# Redis cache of measurement results, shared by all workers
+_MEASUREMENT_CACHE_KEY = "measurement:{}"
+_MEASUREMENT_CACHE_TTL_SECONDS = 3600
+
+# Azure HTTP calls are retried on connection errors and these transient statuses
+_RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+_HTTP_ATTEMPTS = 4
+
+# Chunk size used when reading uploads
+_UPLOAD_READ_CHUNK_SIZE = 64 * 1024
+
+# Uploads whose image header has not parsed within this many bytes are rejected
+_IMAGE_HEADER_BUDGET = 256 * 1024
+
+# Pillow only opens WebP from the whole file, so its RIFF header is read directly
+_WEBP_HEADER_SIZE = 30
+
+# Largest side of the downscaled copy sent to Vision and the ML model
+_ANALYSIS_IMAGE_SIZE = (1280, 1280)
+
+# Statistical model: each measurement is height * h + weight * w, row 0 female, row 1 male
+_STATISTICAL_MEASUREMENTS = ("chest", "waist", "hips", "shoulder_width", "arm_length", "inseam")
+_HEIGHT_COEFFICIENTS = np.array([
+    [0.53, 0.42, 0.55, 0.24, 0.36, 0.42],
+    [0.55, 0.45, 0.52, 0.26, 0.38, 0.44],
+])
+_WEIGHT_COEFFICIENTS = np.array([
+    [0.12, 0.18, 0.14, 0.0, 0.0, 0.0],
+    [0.10, 0.15, 0.12, 0.0, 0.0, 0.0],
+])
+# Chest, waist and hips scale with body type and age; the skeletal lengths do not
+_SOFT_MEASUREMENTS = slice(0, 3)
+
+# Chest, waist and hips multipliers per body type
+_BODY_TYPE_ADJUSTMENTS = MappingProxyType({
+    "slim": np.array([0.9, 0.85, 0.9]),
+    "athletic": np.array([1.1, 0.95, 1.0]),
+    "average": np.array([1.0, 1.0, 1.0]),
+    "curvy": np.array([1.05, 1.1, 1.15]),
+    "plus_size": np.array([1.2, 1.25, 1.2]),
+})
+_DEFAULT_BODY_TYPE_ADJUSTMENT = np.ones(3)
+
+# Shirt sizes by chest circumference (cm); each bound is the smallest chest of the next size
+_SHIRT_BOUNDS = np.array([85, 90, 95, 100, 105])
+_SHIRT_LABELS = np.array(["XS", "S", "M", "L", "XL", "XXL"])
+
+
+def _webp_dimensions(head: bytes) -> Optional[Tuple[int, int]]:
+    """Return (width, height) from a WebP file's first 30 bytes, or None if malformed"""
+    if len(head) < _WEBP_HEADER_SIZE or head[:4] != b"RIFF" or head[8:12] != b"WEBP":
+        return None
+    chunk = head[12:16]
+    if chunk == b"VP8 " and head[23:26] == b"\x9d\x01\x2a":
+        return (
+            int.from_bytes(head[26:28], "little") & 0x3FFF,
+            int.from_bytes(head[28:30], "little") & 0x3FFF,
+        )
+    if chunk == b"VP8L" and head[20] == 0x2F:
+        bits = int.from_bytes(head[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        return int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+    return None
+
+
 class BodyMeasurementService:
     """Service for body measurement analysis"""
     
     def __init__(self):
         self.azure_client = AzureClient.get_instance()
-        self.measurement_cache: Dict[str, MeasurementResult] = {}
+        self.redis = redis.from_url(settings.REDIS_URL)
+        self._session: Optional[aiohttp.ClientSession] = None
+        
+        # Image decoding gets its own core-sized pool so it cannot starve the default
+        # executor, which aiohttp also uses for DNS resolution
+        self._image_executor = ThreadPoolExecutor(
+            max_workers=os.cpu_count(),
+            thread_name_prefix="measurement-image"
+        )
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Return the shared HTTP session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=30),
+                json_serialize=lambda obj: orjson.dumps(obj).decode()
+            )
+        return self._session
+    
+    async def _post(self, url: str, **kwargs) -> Tuple[int, bytes]:
+        """POST to an Azure endpoint with jittered exponential backoff, returning status and body"""
+        session = await self._get_session()
+        
+        async def attempt() -> Tuple[int, bytes]:
+            async with session.post(url, **kwargs) as response:
+                return response.status, await response.read()
+        
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(_HTTP_ATTEMPTS),
+            wait=wait_random_exponential(min=0.5, max=8),
+            retry=(
+                retry_if_exception_type((aiohttp.ClientError, asyncio.TimeoutError))
+                | retry_if_result(lambda result: result[0] in _RETRYABLE_STATUSES)
+            ),
+            # Out of attempts: hand back the last response, or re-raise the last error
+            retry_error_callback=lambda state: state.outcome.result()
+        )
+        return await retrying(attempt)
+    
+    async def warm_up(self):
+        """Open the HTTP session, Redis and database connections before the first request
+        
+        This is only an optimization; if a backend is unreachable at boot the
+        connection is opened by the first request instead.
+        """
+        await self._get_session()
+        try:
+            await asyncio.gather(self.redis.ping(), get_database().execute("SELECT 1"))
+        except Exception as e:
+            logger.error("Body measurement warm-up failed", error=str(e))
+    
+    async def aclose(self):
+        """Release pooled HTTP connections, Redis and the image pool"""
+        if self._session is not None:
+            await self._session.close()
+        await self.redis.aclose()
+        self._image_executor.shutdown(wait=False)
         
     async def analyze_image(self, image_file) -> Dict[str, Any]:
         """Analyze body measurements from uploaded image"""
@@ -38,13 +173,13 @@ class BodyMeasurementService:
             logger.info("Starting body measurement analysis", measurement_id=measurement_id)
             
             # Validate and process image
-            image_data = await self._process_image(image_file)
+            image_data, analysis_data, analysis_scale = await self._process_image(image_file)
             
-            # Upload image to Azure Blob Storage
-            image_url = await self._upload_measurement_image(image_data, measurement_id)
-            
-            # Analyze measurements using Azure Computer Vision
-            measurements = await self._analyze_measurements(image_data, measurement_id)
+            # Upload image to Azure Blob Storage while analyzing it with Azure Computer Vision
+            image_url, measurements = await asyncio.gather(
+                self._upload_measurement_image(image_data, measurement_id),
+                self._analyze_measurements(analysis_data, measurement_id, analysis_scale)
+            )
             
             # Calculate additional measurements
             enhanced_measurements = await self._calculate_derived_measurements(measurements)
@@ -58,15 +193,10 @@ class BodyMeasurementService:
                 created_at=datetime.utcnow()
             )
             
-            # Cache result
-            self.measurement_cache[measurement_id] = result
-            
             # Save to database
             await self._save_measurement_result(result)
             
-            logger.info("Body measurement analysis completed", measurement_id=measurement_id)
-            
-            return {
+            response = {
                 "measurement_id": measurement_id,
                 "measurements": enhanced_measurements,
                 "confidence_score": result.confidence_score,
@@ -74,6 +204,21 @@ class BodyMeasurementService:
                 "created_at": result.created_at.isoformat()
             }
             
+            # Write through to the shared cache; the measurement is already saved, so a
+            # cache failure must not fail the request
+            try:
+                await self.redis.setex(
+                    _MEASUREMENT_CACHE_KEY.format(measurement_id),
+                    _MEASUREMENT_CACHE_TTL_SECONDS,
+                    orjson.dumps(response)
+                )
+            except Exception as e:
+                logger.error("Failed to cache measurement result", error=str(e), measurement_id=measurement_id)
+            
+            logger.info("Body measurement analysis completed", measurement_id=measurement_id)
+            
+            return response
+            
         except Exception as e:
             logger.error("Body measurement analysis failed", error=str(e))
             raise
@@ -82,15 +227,10 @@ class BodyMeasurementService:
         """Get measurement result by ID"""
         try:
             # Check cache first
-            if measurement_id in self.measurement_cache:
-                result = self.measurement_cache[measurement_id]
-                return {
-                    "measurement_id": result.id,
-                    "measurements": result.measurements,
-                    "confidence_score": result.confidence_score,
-                    "image_url": result.image_url,
-                    "created_at": result.created_at.isoformat()
-                }
+            cache_key = _MEASUREMENT_CACHE_KEY.format(measurement_id)
+            cached = await self.redis.get(cache_key)
+            if cached:
+                return orjson.loads(cached)
             
             # Query database
             db = get_database()
@@ -103,13 +243,9 @@ class BodyMeasurementService:
             result = await db.fetchrow(query, measurement_id)
             
             if result:
-                return {
-                    "measurement_id": result["id"],
-                    "measurements": result["measurements"],
-                    "confidence_score": result["confidence_score"],
-                    "image_url": result["image_url"],
-                    "created_at": result["created_at"].isoformat()
-                }
+                measurement = self._measurement_from_row(result)
+                await self.redis.setex(cache_key, _MEASUREMENT_CACHE_TTL_SECONDS, orjson.dumps(measurement))
+                return measurement
             
             return None
             
@@ -160,9 +296,10 @@ class BodyMeasurementService:
     ) -> Dict[str, Any]:
         """Compare two sets of measurements"""
         try:
-            # Get both measurements
-            measurement1 = await self.get_measurement(measurement1_id)
-            measurement2 = await self.get_measurement(measurement2_id)
+            # Get both measurements in a single round trip
+            found = await self._get_measurements_bulk([measurement1_id, measurement2_id])
+            measurement1 = found.get(measurement1_id)
+            measurement2 = found.get(measurement2_id)
             
             if not measurement1 or not measurement2:
                 raise ValueError("One or both measurements not found")
@@ -190,37 +327,147 @@ class BodyMeasurementService:
             logger.error("Failed to compare measurements", error=str(e))
             raise
     
-    async def _process_image(self, image_file) -> bytes:
-        """Process and validate uploaded image"""
+    async def _get_measurements_bulk(self, measurement_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Get several measurement results by ID, querying the database once for cache misses"""
+        found: Dict[str, Dict[str, Any]] = {}
+        missing: List[str] = []
+        
+        measurement_ids = list(dict.fromkeys(measurement_ids))
+        cached = await self.redis.mget([_MEASUREMENT_CACHE_KEY.format(i) for i in measurement_ids])
+        for measurement_id, raw in zip(measurement_ids, cached):
+            if raw:
+                found[measurement_id] = orjson.loads(raw)
+            else:
+                missing.append(measurement_id)
+        
+        if not missing:
+            return found
+        
+        db = get_database()
+        query = """
+            SELECT id, image_url, measurements, confidence_score, created_at
+            FROM body_measurements
+            WHERE id = ANY($1::uuid[])
+        """
+        
+        rows = await db.fetch(query, missing)
+        if not rows:
+            return found
+        
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for row in rows:
+                measurement = self._measurement_from_row(row)
+                found[str(row["id"])] = measurement
+                pipe.setex(
+                    _MEASUREMENT_CACHE_KEY.format(row["id"]),
+                    _MEASUREMENT_CACHE_TTL_SECONDS,
+                    orjson.dumps(measurement)
+                )
+            await pipe.execute()
+        
+        return found
+    
+    @staticmethod
+    def _measurement_from_row(row) -> Dict[str, Any]:
+        """Build the API representation of a body_measurements row"""
+        return {
+            "measurement_id": str(row["id"]),
+            "measurements": orjson.loads(row["measurements"]),
+            "confidence_score": row["confidence_score"],
+            "image_url": row["image_url"],
+            "created_at": row["created_at"].isoformat()
+        }
+    
+    async def _process_image(self, image_file) -> Tuple[bytes, bytes, float]:
+        """Process and validate uploaded image, returning full-size and analysis-size JPEGs and their scale"""
         try:
-            # Read image data
-            image_data = await image_file.read()
-            
-            # Validate image format
-            try:
-                image = Image.open(io.BytesIO(image_data))
-                image.verify()
-            except Exception:
+            # Read the upload in chunks, rejecting it as soon as the header shows it is unusable
+            parser = ImageFile.Parser()
+            chunks = []
+            size = 0
+            dimensions = None
+            while chunk := await image_file.read(_UPLOAD_READ_CHUNK_SIZE):
+                size += len(chunk)
+                if size > settings.MAX_FILE_SIZE:
+                    raise ValueError("Image too large")
+                chunks.append(chunk)
+                
+                if len(chunks) == 1 and chunk[:4] == b"RIFF":
+                    dimensions = _webp_dimensions(chunk)
+                    if dimensions is None:
+                        raise ValueError("Invalid image format")
+                    self._check_image_dimensions(*dimensions)
+                elif dimensions is None:
+                    parser.feed(chunk)
+                    if parser.image is not None:
+                        dimensions = parser.image.size
+                        self._check_image_dimensions(*dimensions)
+                    elif size >= _IMAGE_HEADER_BUDGET:
+                        raise ValueError("Invalid image format")
+            
+            if dimensions is None:
                 raise ValueError("Invalid image format")
+            image_data = b"".join(chunks)
             
-            # Check image size
-            image = Image.open(io.BytesIO(image_data))
-            if image.size[0] < 200 or image.size[1] < 200:
-                raise ValueError("Image too small. Minimum size is 200x200 pixels")
-            
-            # Convert to RGB if necessary
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-                img_byte_arr = io.BytesIO()
-                image.save(img_byte_arr, format='JPEG')
-                image_data = img_byte_arr.getvalue()
-            
-            return image_data
+            # PIL work is blocking, keep it off the event loop
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._image_executor, self._process_image_sync, image_data)
             
         except Exception as e:
             logger.error("Failed to process image", error=str(e))
             raise
     
+    @staticmethod
+    def _check_image_dimensions(width: int, height: int):
+        """Reject images that are too small to measure or large enough to be decompression bombs"""
+        if width < 200 or height < 200:
+            raise ValueError("Image too small. Minimum size is 200x200 pixels")
+        if Image.MAX_IMAGE_PIXELS and width * height > Image.MAX_IMAGE_PIXELS:
+            raise ValueError("Image dimensions too large")
+    
+    @staticmethod
+    def _process_image_sync(image_data: bytes) -> Tuple[bytes, bytes, float]:
+        """Normalize validated image bytes to RGB and derive a downscaled copy for analysis
+        
+        The float is source pixels per analysis pixel, for mapping sizes measured
+        on the analysis copy back to the uploaded image.
+        """
+        # Opening only parses the header, which is enough to read the mode and size
+        try:
+            image = Image.open(io.BytesIO(image_data))
+        except Exception:
+            raise ValueError("Invalid image format")
+        
+        is_small = image.size[0] <= _ANALYSIS_IMAGE_SIZE[0] and image.size[1] <= _ANALYSIS_IMAGE_SIZE[1]
+        if image.mode == 'RGB' and is_small:
+            # Passed through as-is, so decode once to reject truncated or corrupt data
+            try:
+                image.load()
+            except Exception:
+                raise ValueError("Invalid image format")
+            return image_data, image_data, 1.0
+        
+        # Draft decoding below can shrink image.size, so keep the source width
+        source_width = image.size[0]
+        
+        # Convert to RGB if necessary
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+            img_byte_arr = io.BytesIO()
+            image.save(img_byte_arr, format='JPEG')
+            image_data = img_byte_arr.getvalue()
+        else:
+            # Only the downscaled copy is decoded, so let JPEG decode at reduced scale
+            image.draft('RGB', _ANALYSIS_IMAGE_SIZE)
+        
+        if is_small:
+            return image_data, image_data, 1.0
+        
+        image.thumbnail(_ANALYSIS_IMAGE_SIZE, Image.Resampling.LANCZOS)
+        analysis_byte_arr = io.BytesIO()
+        image.save(analysis_byte_arr, format='JPEG', quality=85, optimize=True, progressive=True)
+        return image_data, analysis_byte_arr.getvalue(), source_width / image.size[0]
+    
     async def _upload_measurement_image(self, image_data: bytes, measurement_id: str) -> str:
         """Upload measurement image to Azure Blob Storage"""
         try:
@@ -238,53 +485,59 @@ class BodyMeasurementService:
             logger.error("Failed to upload measurement image", error=str(e), measurement_id=measurement_id)
             raise
     
-    async def _analyze_measurements(self, image_data: bytes, measurement_id: str) -> Dict[str, Any]:
+    async def _analyze_measurements(self, image_data: bytes, measurement_id: str, scale: float = 1.0) -> Dict[str, Any]:
         """Analyze body measurements using Azure Computer Vision"""
         try:
-            # Prepare image for analysis
-            image_base64 = self._encode_image_base64(image_data)
-            
-            # Call Azure Computer Vision API
-            vision_url = f"{settings.AZURE_VISION_ENDPOINT}/analyze"
-            params = {
-                "visualFeatures": "Objects,People",
-                "details": "Landmarks",
-                "language": "en"
-            }
-            
-            headers = {
-                "Ocp-Apim-Subscription-Key": settings.AZURE_VISION_KEY,
-                "Content-Type": "application/octet-stream"
-            }
+            # The ML model does not depend on the Vision result, so run both at once
+            ml_task = asyncio.create_task(self._extract_body_measurements_ml(image_data))
+            try:
+                vision_result = await self._call_vision(image_data)
+            except Exception:
+                ml_task.cancel()
+                raise
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    vision_url,
-                    params=params,
-                    headers=headers,
-                    data=image_data
-                ) as response:
-                    if response.status == 200:
-                        vision_result = await response.json()
-                        
-                        # Extract body measurements from vision result
-                        measurements = await self._extract_measurements_from_vision(vision_result, image_data)
-                        
-                        return measurements
-                    else:
-                        error_text = await response.text()
-                        raise ValueError(f"Vision API failed: {error_text}")
+            # Extract body measurements from vision result
+            return await self._extract_measurements_from_vision(vision_result, await ml_task, image_data, scale)
                         
         except Exception as e:
             logger.error("Failed to analyze measurements", error=str(e), measurement_id=measurement_id)
             raise
     
+    async def _call_vision(self, image_data: bytes) -> Dict[str, Any]:
+        """Run Azure Computer Vision people and object detection on an image"""
+        # Call Azure Computer Vision API
+        vision_url = f"{settings.AZURE_VISION_ENDPOINT}/analyze"
+        params = {
+            "visualFeatures": "Objects,People",
+            "details": "Landmarks",
+            "language": "en"
+        }
+        
+        headers = {
+            "Ocp-Apim-Subscription-Key": settings.AZURE_VISION_KEY,
+            "Content-Type": "application/octet-stream"
+        }
+        
+        status, body = await self._post(
+            vision_url,
+            params=params,
+            headers=headers,
+            data=image_data
+        )
+        if status == 200:
+            return orjson.loads(body)
+        else:
+            error_text = body.decode(errors="replace")
+            raise ValueError(f"Vision API failed: {error_text}")
+    
     async def _extract_measurements_from_vision(
         self,
         vision_result: Dict[str, Any],
-        image_data: bytes
+        body_measurements: Dict[str, Any],
+        image_data: bytes,
+        scale: float = 1.0
     ) -> Dict[str, Any]:
-        """Extract body measurements from Azure Vision API result"""
+        """Extract body measurements from Azure Vision API result; scale maps its pixels to the source image"""
         try:
             measurements = {}
             
@@ -298,13 +551,12 @@ class BodyMeasurementService:
                     # Extract basic measurements from person detection
                     if "faceRectangle" in person:
                         face_rect = person["faceRectangle"]
-                        # Estimate head size
-                        head_width = face_rect["width"]
-                        head_height = face_rect["height"]
+                        # Estimate head size in source-image pixels
+                        head_width = face_rect["width"] * scale
+                        head_height = face_rect["height"] * scale
                         measurements["head_circumference"] = round((head_width + head_height) * 0.5, 1)
                     
-                    # Extract body measurements using custom ML model
-                    body_measurements = await self._extract_body_measurements_ml(image_data)
+                    # Add body measurements from the custom ML model
                     measurements.update(body_measurements)
             
             # If no people detected, use fallback estimation
@@ -334,21 +586,20 @@ class BodyMeasurementService:
                 "model_version": "1.0"
             }
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    ml_endpoint_url,
-                    json=input_data,
-                    headers={
-                        "Authorization": f"Bearer {settings.AZURE_ML_API_KEY}",
-                        "Content-Type": "application/json"
-                    }
-                ) as response:
-                    if response.status == 200:
-                        ml_result = await response.json()
-                        return ml_result.get("measurements", {})
-                    else:
-                        logger.warning("ML model failed, using fallback", status=response.status)
-                        return {}
+            status, body = await self._post(
+                ml_endpoint_url,
+                json=input_data,
+                headers={
+                    "Authorization": f"Bearer {settings.AZURE_ML_API_KEY}",
+                    "Content-Type": "application/json"
+                }
+            )
+            if status == 200:
+                ml_result = orjson.loads(body)
+                return ml_result.get("measurements", {})
+            else:
+                logger.warning("ML model failed, using fallback", status=status)
+                return {}
                         
         except Exception as e:
             logger.error("Failed to extract body measurements with ML", error=str(e))
@@ -357,12 +608,6 @@ class BodyMeasurementService:
     async def _fallback_measurement_estimation(self, image_data: bytes) -> Dict[str, Any]:
         """Fallback measurement estimation when ML models fail"""
         try:
-            # Basic estimation based on image analysis
-            image = Image.open(io.BytesIO(image_data))
-            
-            # Analyze image dimensions and content
-            width, height = image.size
-            
             # Estimate measurements based on image proportions
             # This is a simplified estimation - in production, use more sophisticated algorithms
             estimated_measurements = {
@@ -426,75 +671,65 @@ class BodyMeasurementService:
     ) -> Dict[str, Any]:
         """Calculate measurements using statistical models"""
         try:
-            # Base measurements using statistical formulas
-            if gender.lower() == "male":
-                # Male statistical model
-                chest = height * 0.55 + weight * 0.1
-                waist = height * 0.45 + weight * 0.15
-                hips = height * 0.52 + weight * 0.12
-                shoulder_width = height * 0.26
-                arm_length = height * 0.38
-                inseam = height * 0.44
-            else:
-                # Female statistical model
-                chest = height * 0.53 + weight * 0.12
-                waist = height * 0.42 + weight * 0.18
-                hips = height * 0.55 + weight * 0.14
-                shoulder_width = height * 0.24
-                arm_length = height * 0.36
-                inseam = height * 0.42
-            
-            # Adjust for body type
-            if body_type:
-                adjustments = self._get_body_type_adjustments(body_type)
-                chest *= adjustments.get("chest", 1.0)
-                waist *= adjustments.get("waist", 1.0)
-                hips *= adjustments.get("hips", 1.0)
-            
-            # Adjust for age
-            age_factor = 1.0 + (age - 25) * 0.002  # Slight increase with age
-            
-            return {
-                "height": height,
-                "weight": weight,
-                "chest": round(chest * age_factor, 1),
-                "waist": round(waist * age_factor, 1),
-                "hips": round(hips * age_factor, 1),
-                "shoulder_width": round(shoulder_width, 1),
-                "arm_length": round(arm_length, 1),
-                "inseam": round(inseam, 1),
-                "shoe_size": round(42 + (height - 170) * 0.1, 1)  # Rough estimation
-            }
+            batch = self._calculate_statistical_measurements_batch(
+                np.array([height]),
+                np.array([weight]),
+                np.array([age]),
+                np.array([gender]),
+                np.array([body_type or ""])
+            )
+            return {name: float(values[0]) for name, values in batch.items()}
             
         except Exception as e:
             logger.error("Failed to calculate statistical measurements", error=str(e))
             return {}
     
-    def _get_body_type_adjustments(self, body_type: str) -> Dict[str, float]:
-        """Get measurement adjustments for different body types"""
-        adjustments = {
-            "slim": {"chest": 0.9, "waist": 0.85, "hips": 0.9},
-            "athletic": {"chest": 1.1, "waist": 0.95, "hips": 1.0},
-            "average": {"chest": 1.0, "waist": 1.0, "hips": 1.0},
-            "curvy": {"chest": 1.05, "waist": 1.1, "hips": 1.15},
-            "plus_size": {"chest": 1.2, "waist": 1.25, "hips": 1.2}
-        }
-        return adjustments.get(body_type.lower(), {"chest": 1.0, "waist": 1.0, "hips": 1.0})
+    def _calculate_statistical_measurements_batch(
+        self,
+        heights: np.ndarray,
+        weights: np.ndarray,
+        ages: np.ndarray,
+        genders: np.ndarray,
+        body_types: Optional[np.ndarray] = None
+    ) -> Dict[str, np.ndarray]:
+        """Calculate statistical measurements for many people at once"""
+        heights = np.asarray(heights, dtype=np.float64)
+        weights = np.asarray(weights, dtype=np.float64)
+        ages = np.asarray(ages, dtype=np.float64)
+        
+        # Select the male or female coefficient row per person
+        model = (np.char.lower(np.asarray(genders, dtype=str)) == "male").astype(np.intp)
+        values = heights[:, None] * _HEIGHT_COEFFICIENTS[model] + weights[:, None] * _WEIGHT_COEFFICIENTS[model]
+        
+        # Adjust for body type, looking each distinct type up once
+        if body_types is not None:
+            types, inverse = np.unique(np.asarray(body_types, dtype=str), return_inverse=True)
+            factors = np.stack([self._get_body_type_adjustments(t) for t in types])
+            values[:, _SOFT_MEASUREMENTS] *= factors[inverse]
+        
+        # Adjust for age
+        age_factor = 1.0 + (ages - 25) * 0.002  # Slight increase with age
+        values[:, _SOFT_MEASUREMENTS] *= age_factor[:, None]
+        
+        shoe_sizes = 42 + (heights - 170) * 0.1  # Rough estimation
+        
+        # Round every estimated column in one vector op
+        rounded = np.round(np.column_stack((values, shoe_sizes)), 1)
+        measurements = {"height": heights, "weight": weights}
+        measurements.update(zip(_STATISTICAL_MEASUREMENTS + ("shoe_size",), rounded.T))
+        return measurements
+    
+    def _get_body_type_adjustments(self, body_type: str) -> np.ndarray:
+        """Get chest, waist and hips multipliers for a body type"""
+        return _BODY_TYPE_ADJUSTMENTS.get(body_type.lower(), _DEFAULT_BODY_TYPE_ADJUSTMENT)
     
     def _estimate_shirt_size(self, chest: float) -> str:
         """Estimate shirt size based on chest measurement"""
-        if chest < 85:
-            return "XS"
-        elif chest < 90:
-            return "S"
-        elif chest < 95:
-            return "M"
-        elif chest < 100:
-            return "L"
-        elif chest < 105:
-            return "XL"
-        else:
-            return "XXL"
+        return str(_SHIRT_LABELS[np.searchsorted(_SHIRT_BOUNDS, chest, side="right")])
+    
+    def _estimate_shirt_size_batch(self, chests: np.ndarray) -> np.ndarray:
+        """Estimate shirt sizes for an array of chest measurements"""
+        return _SHIRT_LABELS[np.searchsorted(_SHIRT_BOUNDS, chests, side="right")]
     
     def _estimate_pants_size(self, waist: float, inseam: float) -> str:
         """Estimate pants size based on waist and inseam"""
@@ -508,25 +743,29 @@ class BodyMeasurementService:
     
     def _encode_image_base64(self, image_data: bytes) -> str:
         """Encode image data to base64 string"""
-        import base64
-        return base64.b64encode(image_data).decode('utf-8')
+        return binascii.b2a_base64(image_data, newline=False).decode('ascii')
     
     async def _save_measurement_result(self, result: MeasurementResult):
         """Save measurement result to database"""
         try:
             db = get_database()
             
+            # Upsert so a retried save is idempotent
             query = """
                 INSERT INTO body_measurements (
                     id, image_url, measurements, confidence_score, created_at
-                ) VALUES ($1, $2, $3, $4, $5)
+                ) VALUES ($1, $2, $3::jsonb, $4, $5)
+                ON CONFLICT (id) DO UPDATE SET
+                    image_url = EXCLUDED.image_url,
+                    measurements = EXCLUDED.measurements,
+                    confidence_score = EXCLUDED.confidence_score
             """
             
             await db.execute(
                 query,
                 result.id,
                 result.image_url,
-                json.dumps(result.measurements),
+                orjson.dumps(result.measurements).decode(),
                 result.confidence_score,
                 result.created_at
             )
@@ -6,11 +6,16 @@ Handles product matching and aggregation across different e-commerce platforms
 import asyncio
 import logging
 import uuid
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List
-import json
+from functools import lru_cache
+from typing import Dict, Any, Optional, List, Tuple
 import aiohttp
+import numpy as np
+import orjson
 import structlog
+from cachetools import TTLCache
+from lxml import html as lxml_html
 from urllib.parse import urlparse, parse_qs
 import re
 
@@ -18,9 +23,86 @@ from app.core.config import settings
 from app.utils.azure_client import AzureClient
 from app.models.products import ProductMatch, MatchResult
 from app.core.database import get_database
+from app.services._text_math import jaccard_many, pack_token_hashes, token_hashes
 
 logger = structlog.get_logger()
 
+# Relevance weights for name, brand, category, price and description similarity
+_RELEVANCE_WEIGHTS = np.array([0.4, 0.2, 0.15, 0.15, 0.1])
+_PREFILTER_WEIGHTS = _RELEVANCE_WEIGHTS[:4]
+_DESCRIPTION_WEIGHT = float(_RELEVANCE_WEIGHTS[4])
+_TEXT_FIELDS = ("name", "brand", "category", "description")
+
+# Matches scoring at or below this relevance are dropped
+_MIN_RELEVANCE = 0.3
+
+# Recent match results, keyed by the normalized query
+_MATCH_CACHE_SIZE = 1024
+_MATCH_CACHE_TTL_SECONDS = 600
+
+# Match results kept queued while the database is unavailable; the oldest are dropped beyond this
+_MAX_PENDING_SAVES = 10_000
+
+# Last price recorded per (product, platform); unchanged prices are not written to price history again
+_PRICE_SEEN_CACHE_SIZE = 100_000
+_PRICE_SEEN_TTL_SECONDS = 86400
+
+# Platforms with dedicated extractors, matched against URL host labels
+_EXTRACTOR_PLATFORMS = frozenset({"amazon", "ebay", "walmart", "target", "bestbuy", "newegg"})
+
+# Product ID patterns in platform URLs
+_ASIN_RE = re.compile(r'/dp/([A-Z0-9]{10})')
+_EBAY_ITEM_RE = re.compile(r'/itm/(\d+)')
+_WALMART_PRODUCT_RE = re.compile(r'/ip/([^/]+)')
+_PRODUCT_SLUG_RE = re.compile(r'/p/([^/]+)')
+
+# Generic page scraping: pages are read up to a cap and parsed with lxml
+_MAX_PAGE_BYTES = 2 * 1024 * 1024
+_PAGE_CHUNK_SIZE = 64 * 1024
+_PRICE_XPATH = 'string((//*[contains(@itemprop, "price") or contains(@class, "price")])[1])'
+_PRICE_TEXT_RE = re.compile(r'(\d+(?:\.\d{2})?)')
+_PRICE_RE = re.compile(rb'\$(\d+(?:\.\d{2})?)')
+# An element _PRICE_XPATH would select, followed by the first digit of its text
+_PRICE_ELEMENT_RE = re.compile(rb'(?:itemprop|class)\s*=\s*["\'][^"\'>]*price[^>]*>(?:[^<\d]*<[^>]*>){0,4}[^<\d]*\d')
+_TITLE_END_RE = re.compile(rb'</title\s*>', re.IGNORECASE)
+# Bytes re-scanned from the previous chunk so markers split across chunks are still found
+_SCAN_OVERLAP = 512
+
+
+@lru_cache(maxsize=4096)
+def _resolve_platform(host: str) -> str:
+    """Return the platform named by one of the host's labels, falling back to generic"""
+    return next((label for label in host.split(".") if label in _EXTRACTOR_PLATFORMS), "generic")
+
+
+@dataclass(slots=True)
+class SearchBatch:
+    """Platform search results in columnar form, with the original rows kept for the response"""
+    raw: List[Dict[str, Any]]
+    names: List[str]
+    brands: List[str]
+    categories: List[str]
+    descriptions: List[str]
+    prices: np.ndarray  # float64, NaN where a result has no price
+    
+    def __len__(self) -> int:
+        return len(self.raw)
+    
+    @classmethod
+    def from_results(cls, results: List[Dict[str, Any]]) -> "SearchBatch":
+        """Build a batch from per-row result dicts"""
+        return cls(
+            raw=results,
+            names=[result.get("name") for result in results],
+            brands=[result.get("brand") for result in results],
+            categories=[result.get("category") for result in results],
+            descriptions=[result.get("description") for result in results],
+            prices=np.fromiter(
+                (result.get("price") or np.nan for result in results), dtype=np.float64, count=len(results)
+            )
+        )
+
+
 class ProductMatchingService:
     """Service for product matching across platforms"""
     
@@ -34,7 +116,45 @@ class ProductMatchingService:
             "bestbuy": BestBuyAdapter(),
             "newegg": NeweggAdapter()
         }
-        self.matching_cache: Dict[str, MatchResult] = {}
+        self._extractors = {
+            "amazon": self._extract_amazon_product,
+            "ebay": self._extract_ebay_product,
+            "walmart": self._extract_walmart_product,
+            "target": self._extract_target_product,
+            "bestbuy": self._extract_bestbuy_product,
+            "newegg": self._extract_newegg_product,
+            "generic": self._extract_generic_product
+        }
+        self.matching_cache: TTLCache = TTLCache(maxsize=_MATCH_CACHE_SIZE, ttl=_MATCH_CACHE_TTL_SECONDS)
+        
+        # Matching runs in progress, shared by concurrent identical queries
+        self._inflight_matches: Dict[Tuple, asyncio.Task] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        
+        # Match results waiting to be written, flushed to the database in batches
+        self._pending_saves: List[Tuple[Any, ...]] = []
+        
+        # Observed price changes waiting to be written to price history with the same flusher
+        self._pending_prices: List[Tuple[Any, ...]] = []
+        self._last_price_seen: TTLCache = TTLCache(maxsize=_PRICE_SEEN_CACHE_SIZE, ttl=_PRICE_SEEN_TTL_SECONDS)
+        self._save_flusher_task = asyncio.create_task(self._save_flusher())
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Return the shared HTTP session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=100, limit_per_host=10, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=10)
+            )
+        return self._session
+    
+    async def aclose(self):
+        """Write pending match results and prices and release pooled HTTP connections"""
+        self._save_flusher_task.cancel()
+        await self._flush_saves()
+        await self._flush_prices()
+        if self._session is not None:
+            await self._session.close()
         
     async def find_matches(
         self,
@@ -44,52 +164,90 @@ class ProductMatchingService:
     ) -> List[Dict[str, Any]]:
         """Find matching products across platforms"""
         try:
-            match_id = str(uuid.uuid4())
-            
-            logger.info("Starting product matching", match_id=match_id, source_url=source_url)
-            
-            # Extract product information from source URL
-            source_product = await self._extract_product_info(source_url)
-            if not source_product:
-                raise ValueError("Could not extract product information from source URL")
-            
-            # Find matches on target platforms
-            matches = []
-            for platform in target_platforms:
-                if platform in self.platform_adapters:
-                    platform_matches = await self._find_platform_matches(
-                        source_product, platform, criteria
-                    )
-                    matches.extend(platform_matches)
-            
-            # Sort matches by relevance score
-            matches.sort(key=lambda x: x.get("relevance_score", 0), reverse=True)
-            
-            # Store match result
-            result = MatchResult(
-                id=match_id,
-                source_url=source_url,
-                source_product=source_product,
-                matches=matches,
-                target_platforms=target_platforms,
-                criteria=criteria or {},
-                created_at=datetime.utcnow()
+            # Identical queries within the TTL are answered from the cache
+            cache_key = (
+                source_url,
+                tuple(sorted(target_platforms)),
+                orjson.dumps(criteria, default=str, option=orjson.OPT_SORT_KEYS) if criteria else b""
             )
+            cached = self.matching_cache.get(cache_key)
+            if cached:
+                return cached.matches
+            
+            # Identical queries already running are joined rather than repeated
+            task = self._inflight_matches.get(cache_key)
+            if task is None:
+                task = asyncio.create_task(
+                    self._run_matching(cache_key, source_url, target_platforms, criteria)
+                )
+                self._inflight_matches[cache_key] = task
+                task.add_done_callback(lambda _: self._inflight_matches.pop(cache_key, None))
             
-            # Cache result
-            self.matching_cache[match_id] = result
-            
-            # Save to database
-            await self._save_match_result(result)
-            
-            logger.info("Product matching completed", match_id=match_id, match_count=len(matches))
-            
-            return matches
+            # Shielded so one caller disconnecting does not cancel the others
+            return await asyncio.shield(task)
             
         except Exception as e:
             logger.error("Product matching failed", error=str(e), source_url=source_url)
             raise
     
+    async def _run_matching(
+        self,
+        cache_key: Tuple,
+        source_url: str,
+        target_platforms: List[str],
+        criteria: Optional[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """Extract the source product, match it on every platform, then cache and save the result"""
+        match_id = str(uuid.uuid4())
+        
+        logger.info("Starting product matching", match_id=match_id, source_url=source_url)
+        
+        # Extract product information from source URL
+        source_product = await self._extract_product_info(source_url)
+        if not source_product:
+            raise ValueError("Could not extract product information from source URL")
+        
+        # Find matches on all target platforms concurrently, resolving each adapter once
+        adapters = self._resolve_adapters(target_platforms)
+        results = await asyncio.gather(
+            *[
+                self._find_platform_matches(source_product, platform, adapter, criteria)
+                for platform, adapter in adapters
+            ],
+            return_exceptions=True
+        )
+        
+        matches = []
+        for (platform, _), platform_matches in zip(adapters, results):
+            if isinstance(platform_matches, Exception):
+                logger.error("Failed to find platform matches", error=str(platform_matches), platform=platform)
+                continue
+            matches.extend(platform_matches)
+        
+        # Sort matches by relevance score
+        matches.sort(key=lambda x: x.get("relevance_score", 0), reverse=True)
+        
+        # Store match result
+        result = MatchResult(
+            id=match_id,
+            source_url=source_url,
+            source_product=source_product,
+            matches=matches,
+            target_platforms=target_platforms,
+            criteria=criteria or {},
+            created_at=datetime.utcnow()
+        )
+        
+        # Cache result
+        self.matching_cache[cache_key] = result
+        
+        # Save to database
+        await self._save_match_result(result)
+        
+        logger.info("Product matching completed", match_id=match_id, match_count=len(matches))
+        
+        return matches
+    
     async def get_match_history(self, user_id: str, limit: int = 20) -> List[Dict[str, Any]]:
         """Get user's match history"""
         try:
@@ -128,53 +286,86 @@ class ProductMatchingService:
     ) -> Dict[str, Any]:
         """Compare prices for a product across platforms"""
         try:
-            # Get product information
-            product = await self._get_product_by_id(product_id)
-            if not product:
+            comparisons = await self.compare_prices_bulk([product_id], platforms)
+            if product_id not in comparisons:
                 raise ValueError("Product not found")
+            return comparisons[product_id]
             
-            # Get current prices from all platforms
-            price_comparison = {}
+        except Exception as e:
+            logger.error("Price comparison failed", error=str(e), product_id=product_id)
+            raise
+    
+    async def compare_prices_bulk(
+        self,
+        product_ids: List[str],
+        platforms: Optional[List[str]] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """Compare prices for several products across platforms, keyed by product ID
+        
+        Each platform is asked for all products in one bulk lookup; unknown
+        product IDs are left out of the result.
+        """
+        try:
+            products = await self._get_products_by_ids(product_ids)
+            if not products:
+                return {}
+            
+            # Get current prices from all platforms, one request per platform
             target_platforms = platforms or list(self.platform_adapters.keys())
+            adapters = self._resolve_adapters(target_platforms)
+            platform_prices = await asyncio.gather(
+                *[self._get_platform_prices(products, platform, adapter) for platform, adapter in adapters]
+            )
             
-            for platform in target_platforms:
-                if platform in self.platform_adapters:
-                    price_info = await self._get_platform_price(product, platform)
+            comparisons = {}
+            for product_id, product in products.items():
+                price_comparison = {}
+                for (platform, _), prices in zip(adapters, platform_prices):
+                    price_info = prices.get(product_id)
                     if price_info:
                         price_comparison[platform] = price_info
+                comparisons[product_id] = self._summarize_prices(product, price_comparison)
             
-            # Find best deals
-            prices = [info["price"] for info in price_comparison.values() if info["price"]]
-            if prices:
-                min_price = min(prices)
-                max_price = max(prices)
-                avg_price = sum(prices) / len(prices)
-                
-                best_deals = [
-                    platform for platform, info in price_comparison.items()
-                    if info["price"] == min_price
-                ]
-            else:
-                min_price = max_price = avg_price = 0
-                best_deals = []
-            
-            return {
-                "product": product,
-                "price_comparison": price_comparison,
-                "statistics": {
-                    "min_price": min_price,
-                    "max_price": max_price,
-                    "avg_price": round(avg_price, 2),
-                    "price_range": max_price - min_price if prices else 0,
-                    "best_deals": best_deals
-                },
-                "last_updated": datetime.utcnow().isoformat()
-            }
+            return comparisons
             
         except Exception as e:
-            logger.error("Price comparison failed", error=str(e), product_id=product_id)
+            logger.error("Bulk price comparison failed", error=str(e), product_count=len(product_ids))
             raise
     
+    def _summarize_prices(
+        self,
+        product: Dict[str, Any],
+        price_comparison: Dict[str, Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Build the price comparison payload for one product"""
+        # Find best deals
+        prices = [info["price"] for info in price_comparison.values() if info["price"]]
+        if prices:
+            min_price = min(prices)
+            max_price = max(prices)
+            avg_price = sum(prices) / len(prices)
+            
+            best_deals = [
+                platform for platform, info in price_comparison.items()
+                if info["price"] == min_price
+            ]
+        else:
+            min_price = max_price = avg_price = 0
+            best_deals = []
+        
+        return {
+            "product": product,
+            "price_comparison": price_comparison,
+            "statistics": {
+                "min_price": min_price,
+                "max_price": max_price,
+                "avg_price": round(avg_price, 2),
+                "price_range": max_price - min_price if prices else 0,
+                "best_deals": best_deals
+            },
+            "last_updated": datetime.utcnow().isoformat()
+        }
+    
     async def track_price_history(
         self,
         product_id: str,
@@ -214,24 +405,10 @@ class ProductMatchingService:
         """Extract product information from URL"""
         try:
             parsed_url = urlparse(url)
-            domain = parsed_url.netloc.lower()
-            
-            # Determine platform and extract product info
-            if "amazon" in domain:
-                return await self._extract_amazon_product(url)
-            elif "ebay" in domain:
-                return await self._extract_ebay_product(url)
-            elif "walmart" in domain:
-                return await self._extract_walmart_product(url)
-            elif "target" in domain:
-                return await self._extract_target_product(url)
-            elif "bestbuy" in domain:
-                return await self._extract_bestbuy_product(url)
-            elif "newegg" in domain:
-                return await self._extract_newegg_product(url)
-            else:
-                # Generic extraction
-                return await self._extract_generic_product(url)
+            
+            # Determine platform from the domain labels, so regional hosts like amazon.co.uk still match
+            platform = _resolve_platform(parsed_url.hostname or "")
+            return await self._extractors[platform](url)
                 
         except Exception as e:
             logger.error("Failed to extract product info", error=str(e), url=url)
@@ -241,7 +418,7 @@ class ProductMatchingService:
         """Extract product information from Amazon URL"""
         try:
             # Extract ASIN from URL
-            asin_match = re.search(r'/dp/([A-Z0-9]{10})', url)
+            asin_match = _ASIN_RE.search(url)
             asin = asin_match.group(1) if asin_match else None
             
             if not asin:
@@ -274,7 +451,7 @@ class ProductMatchingService:
         """Extract product information from eBay URL"""
         try:
             # Extract item ID from URL
-            item_match = re.search(r'/itm/(\d+)', url)
+            item_match = _EBAY_ITEM_RE.search(url)
             item_id = item_match.group(1) if item_match else None
             
             if not item_id:
@@ -307,7 +484,7 @@ class ProductMatchingService:
         """Extract product information from Walmart URL"""
         try:
             # Extract product ID from URL
-            product_match = re.search(r'/ip/([^/]+)', url)
+            product_match = _WALMART_PRODUCT_RE.search(url)
             product_id = product_match.group(1) if product_match else None
             
             if not product_id:
@@ -340,7 +517,7 @@ class ProductMatchingService:
         """Extract product information from Target URL"""
         try:
             # Extract product ID from URL
-            product_match = re.search(r'/p/([^/]+)', url)
+            product_match = _PRODUCT_SLUG_RE.search(url)
             product_id = product_match.group(1) if product_match else None
             
             if not product_id:
@@ -373,7 +550,7 @@ class ProductMatchingService:
         """Extract product information from Best Buy URL"""
         try:
             # Extract SKU from URL
-            sku_match = re.search(r'/p/([^/]+)', url)
+            sku_match = _PRODUCT_SLUG_RE.search(url)
             sku = sku_match.group(1) if sku_match else None
             
             if not sku:
@@ -406,7 +583,7 @@ class ProductMatchingService:
         """Extract product information from Newegg URL"""
         try:
             # Extract product ID from URL
-            product_match = re.search(r'/p/([^/]+)', url)
+            product_match = _PRODUCT_SLUG_RE.search(url)
             product_id = product_match.group(1) if product_match else None
             
             if not product_id:
@@ -439,50 +616,69 @@ class ProductMatchingService:
         """Extract product information from generic URL"""
         try:
             # Basic web scraping for generic sites
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        html = await response.text()
-                        
-                        # Extract basic information using regex patterns
-                        title_match = re.search(r'<title[^>]*>([^<]+)</title>', html, re.IGNORECASE)
-                        title = title_match.group(1).strip() if title_match else ""
-                        
-                        # Try to extract price
-                        price_match = re.search(r'\$(\d+(?:\.\d{2})?)', html)
-                        price = float(price_match.group(1)) if price_match else None
-                        
-                        return {
-                            "platform": "generic",
-                            "product_id": str(uuid.uuid4()),
-                            "name": title,
-                            "description": "",
-                            "price": price,
-                            "currency": "USD",
-                            "image_url": "",
-                            "category": "",
-                            "brand": "",
-                            "url": url
-                        }
-                    else:
-                        raise ValueError(f"Failed to fetch URL: {response.status}")
-                        
+            session = await self._get_session()
+            async with session.get(url) as response:
+                if response.status == 200:
+                    # Read until both a title and a price element have arrived, capped at _MAX_PAGE_BYTES;
+                    # a bare "$35" elsewhere (banners, scripts) does not end the read
+                    body = bytearray()
+                    title_seen = price_seen = False
+                    async for chunk in response.content.iter_chunked(_PAGE_CHUNK_SIZE):
+                        scan_from = max(0, len(body) - _SCAN_OVERLAP)
+                        body += chunk
+                        title_seen = title_seen or _TITLE_END_RE.search(body, scan_from) is not None
+                        price_seen = price_seen or _PRICE_ELEMENT_RE.search(body, scan_from) is not None
+                        if (title_seen and price_seen) or len(body) >= _MAX_PAGE_BYTES:
+                            # Drop the rest of the page rather than download it
+                            response.close()
+                            break
+                    if not body:
+                        raise ValueError("Empty response body")
+                    
+                    # Parse the raw bytes with lxml and pick out the title
+                    doc = lxml_html.document_fromstring(
+                        bytes(body[:_MAX_PAGE_BYTES]),
+                        parser=lxml_html.HTMLParser(encoding=response.charset)
+                    )
+                    title = (doc.findtext('.//title') or "").strip()
+                    
+                    # Try to extract price from a price element, then anywhere on the page
+                    price_match = _PRICE_TEXT_RE.search(doc.xpath(_PRICE_XPATH)) or _PRICE_RE.search(body)
+                    price = float(price_match.group(1)) if price_match else None
+                    
+                    return {
+                        "platform": "generic",
+                        "product_id": str(uuid.uuid4()),
+                        "name": title,
+                        "description": "",
+                        "price": price,
+                        "currency": "USD",
+                        "image_url": "",
+                        "category": "",
+                        "brand": "",
+                        "url": url
+                    }
+                else:
+                    raise ValueError(f"Failed to fetch URL: {response.status}")
+                    
         except Exception as e:
             logger.error("Failed to extract generic product", error=str(e), url=url)
             raise
     
+    def _resolve_adapters(self, platforms: List[str]) -> List[Tuple[str, Any]]:
+        """Pair each known platform with its adapter, dropping unknown platforms"""
+        adapters = self.platform_adapters
+        return [(platform, adapters[platform]) for platform in platforms if platform in adapters]
+    
     async def _find_platform_matches(
         self,
         source_product: Dict[str, Any],
         platform: str,
+        adapter: Any,
         criteria: Optional[Dict[str, Any]]
     ) -> List[Dict[str, Any]]:
         """Find matches on a specific platform"""
         try:
-            adapter = self.platform_adapters.get(platform)
-            if not adapter:
-                return []
-            
             # Search for similar products
             search_results = await adapter.search_products(
                 source_product["name"],
@@ -491,164 +687,247 @@ class ProductMatchingService:
                 criteria
             )
             
-            # Calculate relevance scores
-            matches = []
-            for result in search_results:
-                relevance_score = self._calculate_relevance_score(source_product, result)
-                if relevance_score > 0.3:  # Minimum relevance threshold
-                    matches.append({
-                        **result,
-                        "relevance_score": relevance_score,
-                        "platform": platform
-                    })
-            
-            return matches
+            # Calculate relevance scores for all results at once
+            scores = self._batch_relevance_scores(source_product, search_results, _MIN_RELEVANCE)
+            return [
+                {
+                    **result,
+                    "relevance_score": float(relevance_score),
+                    "platform": platform
+                }
+                for result, relevance_score in zip(search_results.raw, scores)
+                if relevance_score > _MIN_RELEVANCE
+            ]
             
         except Exception as e:
             logger.error("Failed to find platform matches", error=str(e), platform=platform)
             return []
     
+    def _batch_relevance_scores(
+        self,
+        source_product: Dict[str, Any],
+        targets: SearchBatch,
+        min_score: float = 0.0
+    ) -> np.ndarray:
+        """Calculate relevance scores between a product and many candidates
+
+        Candidates that cannot score above ``min_score`` skip the description
+        comparison, so their returned score is only a lower bound.
+        """
+        n = len(targets)
+        features = np.zeros((n, len(_RELEVANCE_WEIGHTS)))
+        if n == 0:
+            return features[:, 0]
+        
+        # Name, brand and category similarities over hashed word sets, tokenizing the source once
+        text_columns = (targets.names, targets.brands, targets.categories)
+        for column, (field, target_texts) in enumerate(zip(_TEXT_FIELDS, text_columns)):
+            source_tokens = token_hashes(source_product.get(field))
+            if source_tokens.size:
+                flat, offsets = pack_token_hashes(target_texts)
+                features[:, column] = jaccard_many(source_tokens, flat, offsets)
+        
+        # Price similarity, only where both prices are known
+        source_price = source_product.get("price")
+        if source_price:
+            price_similarity = np.maximum(0, 1 - np.abs(targets.prices - source_price) / source_price)
+            features[:, 3] = np.nan_to_num(price_similarity, nan=0.0)
+        
+        # Description is the longest text, so only compare it where it can lift the score past min_score
+        source_tokens = token_hashes(source_product.get("description"))
+        if source_tokens.size:
+            upper_bound = features[:, :4] @ _PREFILTER_WEIGHTS + _DESCRIPTION_WEIGHT
+            survivors = np.flatnonzero(upper_bound > min_score)
+            if survivors.size:
+                flat, offsets = pack_token_hashes(targets.descriptions[i] for i in survivors)
+                features[survivors, 4] = jaccard_many(source_tokens, flat, offsets)
+        
+        return np.minimum(1.0, features @ _RELEVANCE_WEIGHTS)
+    
     def _calculate_relevance_score(
         self,
         source_product: Dict[str, Any],
         target_product: Dict[str, Any]
     ) -> float:
         """Calculate relevance score between two products"""
-        try:
-            score = 0.0
-            
-            # Name similarity (40% weight)
-            name_similarity = self._calculate_text_similarity(
-                source_product["name"], target_product["name"]
-            )
-            score += name_similarity * 0.4
-            
-            # Brand similarity (20% weight)
-            if source_product.get("brand") and target_product.get("brand"):
-                brand_similarity = self._calculate_text_similarity(
-                    source_product["brand"], target_product["brand"]
-                )
-                score += brand_similarity * 0.2
-            
-            # Category similarity (15% weight)
-            if source_product.get("category") and target_product.get("category"):
-                category_similarity = self._calculate_text_similarity(
-                    source_product["category"], target_product["category"]
-                )
-                score += category_similarity * 0.15
-            
-            # Price similarity (15% weight)
-            if source_product.get("price") and target_product.get("price"):
-                price_diff = abs(source_product["price"] - target_product["price"])
-                price_similarity = max(0, 1 - (price_diff / source_product["price"]))
-                score += price_similarity * 0.15
-            
-            # Description similarity (10% weight)
-            if source_product.get("description") and target_product.get("description"):
-                desc_similarity = self._calculate_text_similarity(
-                    source_product["description"], target_product["description"]
-                )
-                score += desc_similarity * 0.1
-            
-            return min(1.0, score)
-            
-        except Exception as e:
-            logger.error("Failed to calculate relevance score", error=str(e))
-            return 0.0
-    
-    def _calculate_text_similarity(self, text1: str, text2: str) -> float:
-        """Calculate text similarity using basic algorithms"""
-        try:
-            # Convert to lowercase and split into words
-            words1 = set(text1.lower().split())
-            words2 = set(text2.lower().split())
-            
-            if not words1 or not words2:
-                return 0.0
-            
-            # Calculate Jaccard similarity
-            intersection = len(words1.intersection(words2))
-            union = len(words1.union(words2))
-            
-            return intersection / union if union > 0 else 0.0
-            
-        except Exception as e:
-            logger.error("Failed to calculate text similarity", error=str(e))
-            return 0.0
+        return float(self._batch_relevance_scores(source_product, SearchBatch.from_results([target_product]))[0])
     
-    async def _get_platform_price(
+    async def _get_platform_prices(
         self,
-        product: Dict[str, Any],
-        platform: str
-    ) -> Optional[Dict[str, Any]]:
-        """Get current price for a product on a specific platform"""
+        products: Dict[str, Dict[str, Any]],
+        platform: str,
+        adapter: Any
+    ) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Get current prices for several products on a specific platform, keyed by our product ID
+        
+        Adapters are queried with the platform's own product identifiers
+        (ASIN, eBay item ID, ...) and their answers mapped back.
+        """
         try:
-            adapter = self.platform_adapters.get(platform)
-            if not adapter:
-                return None
-            
-            price_info = await adapter.get_product_price(product["product_id"])
-            return price_info
+            internal_ids: Dict[str, List[str]] = {}
+            for product_id, product in products.items():
+                if product["product_id"]:
+                    internal_ids.setdefault(product["product_id"], []).append(product_id)
+            if not internal_ids:
+                return {}
+            
+            platform_prices = await adapter.get_prices_bulk(list(internal_ids))
+            prices = {
+                product_id: price_info
+                for platform_product_id, price_info in platform_prices.items()
+                for product_id in internal_ids.get(platform_product_id, ())
+            }
+            self._record_prices(platform, prices)
+            return prices
             
         except Exception as e:
-            logger.error("Failed to get platform price", error=str(e), platform=platform)
-            return None
+            logger.error("Failed to get platform prices", error=str(e), platform=platform)
+            return {}
     
-    async def _get_product_by_id(self, product_id: str) -> Optional[Dict[str, Any]]:
-        """Get product information by ID"""
+    def _record_prices(self, platform: str, prices: Dict[str, Optional[Dict[str, Any]]]):
+        """Queue fetched prices for price history, skipping ones unchanged since last recorded"""
+        tracked_at = datetime.utcnow()
+        for product_id, price_info in prices.items():
+            if not price_info:
+                continue
+            key = (product_id, platform)
+            snapshot = (price_info.get("price"), price_info.get("currency"), price_info.get("availability"))
+            if self._last_price_seen.get(key) == snapshot:
+                continue
+            self._last_price_seen[key] = snapshot
+            self._pending_prices.append((product_id, platform, *snapshot, tracked_at))
+    
+    async def _get_products_by_ids(self, product_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Get product information for several IDs in one query, keyed by ID"""
         try:
             db = get_database()
             
             query = """
-                SELECT id, name, description, price, image_url, category, brand, platform
+                SELECT id, name, description, price, image_url, category, brand, platform, platform_product_id
                 FROM products
-                WHERE id = $1
+                WHERE id = ANY($1::uuid[])
             """
             
-            result = await db.fetchrow(query, product_id)
-            
-            if result:
-                return {
-                    "id": result["id"],
-                    "name": result["name"],
-                    "description": result["description"],
-                    "price": result["price"],
-                    "image_url": result["image_url"],
-                    "category": result["category"],
-                    "brand": result["brand"],
-                    "platform": result["platform"]
-                }
+            results = await db.fetch(query, product_ids)
             
-            return None
+            return {
+                str(row["id"]): {
+                    "id": row["id"],
+                    "name": row["name"],
+                    "description": row["description"],
+                    "price": row["price"],
+                    "image_url": row["image_url"],
+                    "category": row["category"],
+                    "brand": row["brand"],
+                    "platform": row["platform"],
+                    "product_id": row["platform_product_id"]
+                }
+                for row in results
+            }
             
         except Exception as e:
-            logger.error("Failed to get product by ID", error=str(e), product_id=product_id)
-            return None
+            logger.error("Failed to get products by ID", error=str(e), product_count=len(product_ids))
+            return {}
     
     async def _save_match_result(self, result: MatchResult):
-        """Save match result to database"""
+        """Queue a match result to be saved with the next batch"""
+        # Serialize now so the flusher only does I/O
+        self._pending_saves.append((
+            result.id,
+            result.source_url,
+            orjson.dumps(result.source_product).decode(),
+            orjson.dumps(result.matches, option=orjson.OPT_SERIALIZE_NUMPY).decode(),
+            result.target_platforms,
+            orjson.dumps(result.criteria).decode(),
+            result.created_at
+        ))
+        if len(self._pending_saves) >= settings.MATCH_SAVE_BATCH_SIZE:
+            # The caller already has its result, so a failed save is only logged
+            try:
+                await self._flush_saves()
+            except Exception as e:
+                logger.error("Failed to save match results", error=str(e))
+    
+    async def _save_flusher(self):
+        """Periodically write queued match results and prices to the database"""
+        interval = settings.MATCH_SAVE_FLUSH_INTERVAL_MS / 1000
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._flush_saves()
+            except Exception as e:
+                logger.error("Failed to save match results", error=str(e))
+            try:
+                await self._flush_prices()
+            except Exception as e:
+                logger.error("Failed to save price history", error=str(e))
+    
+    async def _flush_saves(self):
+        """Write all queued match results in a single executemany"""
+        if not self._pending_saves:
+            return
+        pending, self._pending_saves = self._pending_saves, []
+        
+        db = get_database()
+        
+        # Retried rows may already be stored, so inserts are idempotent on id
+        query = """
+            INSERT INTO product_matches (
+                id, source_url, source_product, matches, target_platforms, criteria, created_at
+            ) VALUES ($1, $2, $3, $4, $5, $6, $7)
+            ON CONFLICT (id) DO NOTHING
+        """
+        
         try:
-            db = get_database()
-            
-            query = """
-                INSERT INTO product_matches (
-                    id, source_url, source_product, matches, target_platforms, criteria, created_at
-                ) VALUES ($1, $2, $3, $4, $5, $6, $7)
-            """
-            
-            await db.execute(
-                query,
-                result.id,
-                result.source_url,
-                json.dumps(result.source_product),
-                json.dumps(result.matches),
-                result.target_platforms,
-                json.dumps(result.criteria),
-                result.created_at
-            )
-            
+            await db.executemany(query, pending)
+            return
         except Exception as e:
-            logger.error("Failed to save match result", error=str(e), match_id=result.id)
+            logger.error("Batch save of match results failed, saving row by row", error=str(e), count=len(pending))
+        
+        # One bad row must not lose the rest of the batch
+        failed = []
+        for row in pending:
+            try:
+                await db.execute(query, *row)
+            except Exception as e:
+                failed.append((row, e))
+        if not failed:
+            return
+        
+        if len(failed) < len(pending):
+            # Other rows went through, so these rows are themselves bad
+            for row, e in failed:
+                logger.error("Dropping match result that failed to save", error=str(e), match_id=str(row[0]))
+            return
+        
+        # Nothing could be written: keep the rows for the next flush
+        self._pending_saves[:0] = pending
+        overflow = len(self._pending_saves) - _MAX_PENDING_SAVES
+        if overflow > 0:
+            del self._pending_saves[:overflow]
+            logger.error("Dropped queued match results while the database is unavailable", count=overflow)
+        raise failed[0][1]
+    
+    async def _flush_prices(self):
+        """Write all queued price observations in a single executemany"""
+        if not self._pending_prices:
+            return
+        pending, self._pending_prices = self._pending_prices, []
+        
+        db = get_database()
+        
+        query = """
+            INSERT INTO price_history (
+                product_id, platform, price, currency, availability, tracked_at
+            ) VALUES ($1, $2, $3, $4, $5, $6)
+        """
+        
+        try:
+            await db.executemany(query, pending)
+        except Exception:
+            # Forget the unwritten prices so the next fetch records them again
+            for product_id, platform, *_ in pending:
+                self._last_price_seen.pop((product_id, platform), None)
             raise
     
     # Platform-specific API methods (stubs for now)
@@ -684,60 +963,83 @@ class ProductMatchingService:
 
 
 # Platform adapter classes
-class AmazonAdapter:
-    async def search_products(self, name: str, brand: str, category: str, criteria: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+class PlatformAdapter:
+    """Base for platform adapters; subclasses override get_prices_bulk when the platform has a multi-ID endpoint"""
+    
+    async def search_products(self, name: str, brand: str, category: str, criteria: Optional[Dict[str, Any]]) -> SearchBatch:
+        return SearchBatch.from_results([])
+    
+    async def get_product_price(self, product_id: str) -> Optional[Dict[str, Any]]:
+        return None
+    
+    async def get_prices_bulk(self, product_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Return price info keyed by product ID, falling back to concurrent single lookups"""
+        prices = await asyncio.gather(*[self.get_product_price(product_id) for product_id in product_ids])
+        return dict(zip(product_ids, prices))
+
+
+class AmazonAdapter(PlatformAdapter):
+    async def search_products(self, name: str, brand: str, category: str, criteria: Optional[Dict[str, Any]]) -> SearchBatch:
         # Implementation for Amazon product search
-        return []
+        return SearchBatch.from_results([])
     
     async def get_product_price(self, product_id: str) -> Optional[Dict[str, Any]]:
         # Implementation for Amazon price lookup
         return None
 
 
-class EbayAdapter:
-    async def search_products(self, name: str, brand: str, category: str, criteria: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+class EbayAdapter(PlatformAdapter):
+    async def search_products(self, name: str, brand: str, category: str, criteria: Optional[Dict[str, Any]]) -> SearchBatch:
         # Implementation for eBay product search
-        return []
+        return SearchBatch.from_results([])
     
     async def get_product_price(self, product_id: str) -> Optional[Dict[str, Any]]:
         # Implementation for eBay price lookup
         return None
+    
+    async def get_prices_bulk(self, product_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        # Implementation for eBay multi-item price lookup (Shopping API GetMultipleItems)
+        return dict.fromkeys(product_ids)
 
 
-class WalmartAdapter:
-    async def search_products(self, name: str, brand: str, category: str, criteria: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+class WalmartAdapter(PlatformAdapter):
+    async def search_products(self, name: str, brand: str, category: str, criteria: Optional[Dict[str, Any]]) -> SearchBatch:
         # Implementation for Walmart product search
-        return []
+        return SearchBatch.from_results([])
     
     async def get_product_price(self, product_id: str) -> Optional[Dict[str, Any]]:
         # Implementation for Walmart price lookup
         return None
 
 
-class TargetAdapter:
-    async def search_products(self, name: str, brand: str, category: str, criteria: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+class TargetAdapter(PlatformAdapter):
+    async def search_products(self, name: str, brand: str, category: str, criteria: Optional[Dict[str, Any]]) -> SearchBatch:
         # Implementation for Target product search
-        return []
+        return SearchBatch.from_results([])
     
     async def get_product_price(self, product_id: str) -> Optional[Dict[str, Any]]:
         # Implementation for Target price lookup
         return None
 
 
-class BestBuyAdapter:
-    async def search_products(self, name: str, brand: str, category: str, criteria: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+class BestBuyAdapter(PlatformAdapter):
+    async def search_products(self, name: str, brand: str, category: str, criteria: Optional[Dict[str, Any]]) -> SearchBatch:
         # Implementation for Best Buy product search
-        return []
+        return SearchBatch.from_results([])
     
     async def get_product_price(self, product_id: str) -> Optional[Dict[str, Any]]:
         # Implementation for Best Buy price lookup
         return None
+    
+    async def get_prices_bulk(self, product_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        # Implementation for Best Buy multi-SKU price lookup (sku in(...) query)
+        return dict.fromkeys(product_ids)
 
 
-class NeweggAdapter:
-    async def search_products(self, name: str, brand: str, category: str, criteria: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+class NeweggAdapter(PlatformAdapter):
+    async def search_products(self, name: str, brand: str, category: str, criteria: Optional[Dict[str, Any]]) -> SearchBatch:
         # Implementation for Newegg product search
-        return []
+        return SearchBatch.from_results([])
     
     async def get_product_price(self, product_id: str) -> Optional[Dict[str, Any]]:
         # Implementation for Newegg price lookup
@@ -5,12 +5,16 @@ Handles virtual try-on functionality using Azure ML models
 
 import asyncio
 import logging
+import time
 import uuid
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List
-import json
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, Any, Optional, List, Tuple
 import aiohttp
+import orjson
+import redis.asyncio as redis
 import structlog
+from cachetools import TTLCache
 
 from app.core.config import settings
 from app.utils.azure_client import AzureClient
@@ -19,13 +23,89 @@ from app.core.database import get_database
 
 logger = structlog.get_logger()
 
+# Redis layout: one hash per task, expired by TTL instead of being swept in process.
+# Queued and running tasks only live in this worker, so their hashes get a short TTL
+# that progress writes and the heartbeat refresh; a task lost with its worker then
+# expires to "not found" instead of reporting processing for days
+_TASK_KEY = "tryon_task:{}"
+_TASK_TTL_SECONDS = 7 * 24 * 3600
+_ACTIVE_TASK_TTL_SECONDS = 120
+_TASK_HEARTBEAT_SECONDS = 30
+_TERMINAL_STATUSES = frozenset({"completed", "failed"})
+
+# Task fields mirrored into the task hash; settings is stored as JSON and timestamps as ISO strings
+_TASK_FIELDS = (
+    "id", "user_id", "avatar_id", "product_id", "product_url", "settings",
+    "status", "progress", "result_url", "error", "created_at", "updated_at"
+)
+
+# Product rows are read-mostly, so recent lookups are reused for a short time
+_PRODUCT_CACHE_SIZE = 4096
+_PRODUCT_CACHE_TTL_SECONDS = 60
+
+# Queue lanes: when both have work, one batch task is served per _INTERACTIVE_WEIGHT
+# interactive ones, or immediately once it has waited _BATCH_MAX_WAIT_SECONDS
+_PRIORITIES = ("interactive", "batch")
+_INTERACTIVE_WEIGHT = 4
+_BATCH_MAX_WAIT_SECONDS = 30.0
+
 class VirtualTryOnService:
     """Service for virtual try-on functionality"""
     
     def __init__(self):
         self.azure_client = AzureClient.get_instance()
+        
+        # Task state lives in Redis so any worker replica can serve status calls
+        self.redis = redis.from_url(settings.REDIS_URL, decode_responses=True)
+        
+        # Tasks currently being processed by this worker
         self.active_tasks: Dict[str, TryOnTask] = {}
-        self.processing_queue: asyncio.Queue = asyncio.Queue()
+        
+        # A fixed pool of workers drains the queue lanes; start_try_on waits when they are full
+        self._queues: Dict[str, Deque[Tuple[float, str]]] = {priority: deque() for priority in _PRIORITIES}
+        self._queued = asyncio.Semaphore(0)
+        self._queue_slots = asyncio.Semaphore(settings.TRYON_QUEUE_SIZE)
+        self._interactive_streak = 0
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(settings.MAX_CONCURRENT_TASKS)
+        ]
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        self._session: Optional[aiohttp.ClientSession] = None
+        
+        # ML endpoint URLs and auth headers are fixed for the life of the service
+        self._tryon_url = f"{settings.AZURE_ML_ENDPOINT}/virtual-tryon"
+        self._fit_url = f"{settings.AZURE_ML_ENDPOINT}/fit-analysis"
+        self._auth_headers = {
+            "Authorization": f"Bearer {settings.AZURE_ML_API_KEY}",
+            "Content-Type": "application/json"
+        }
+        
+        self._product_cache: TTLCache = TTLCache(maxsize=_PRODUCT_CACHE_SIZE, ttl=_PRODUCT_CACHE_TTL_SECONDS)
+        
+        # Fit predictions in progress, shared by concurrent identical requests
+        self._inflight_fits: Dict[Tuple[str, str, str], asyncio.Task] = {}
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Return the shared HTTP session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=64, limit_per_host=16, ttl_dns_cache=300, keepalive_timeout=60),
+                json_serialize=lambda obj: orjson.dumps(obj).decode()
+            )
+        return self._session
+    
+    def invalidate_product(self, product_id: str):
+        """Drop a product from the cache after it changes"""
+        self._product_cache.pop(product_id, None)
+    
+    async def aclose(self):
+        """Stop the workers and release pooled HTTP connections and Redis"""
+        for worker in self._workers:
+            worker.cancel()
+        self._heartbeat_task.cancel()
+        if self._session is not None:
+            await self._session.close()
+        await self.redis.aclose()
         
     async def start_try_on(
         self,
@@ -33,13 +113,18 @@ class VirtualTryOnService:
         avatar_id: str,
         product_id: str,
         product_url: Optional[str] = None,
-        settings: Optional[Dict[str, Any]] = None
+        settings: Optional[Dict[str, Any]] = None,
+        priority: str = "interactive"
     ) -> str:
-        """Start virtual try-on process"""
+        """Start virtual try-on process; background catalog runs use the batch priority"""
         try:
+            if priority not in self._queues:
+                raise ValueError(f"Unknown priority: {priority}")
+            
             task_id = str(uuid.uuid4())
             
             # Create try-on task
+            now = datetime.utcnow()
             task = TryOnTask(
                 id=task_id,
                 user_id=user_id,
@@ -48,18 +133,30 @@ class VirtualTryOnService:
                 product_url=product_url,
                 settings=settings or {},
                 status="processing",
-                created_at=datetime.utcnow(),
-                updated_at=datetime.utcnow()
+                created_at=now,
+                updated_at=now
             )
             
-            # Store task
+            # Wait for queue room before writing any state, so a request cancelled
+            # while waiting leaves nothing behind
+            await self._queue_slots.acquire()
+            
+            # Store task; on any failure or cancellation roll back and give the slot back
             self.active_tasks[task_id] = task
+            key = _TASK_KEY.format(task_id)
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    pipe.hset(key, mapping=self._encode_task({name: getattr(task, name) for name in _TASK_FIELDS}))
+                    pipe.expire(key, _ACTIVE_TASK_TTL_SECONDS)
+                    await pipe.execute()
+            except BaseException:
+                self.active_tasks.pop(task_id, None)
+                self._queue_slots.release()
+                raise
             
             # Add to processing queue
-            await self.processing_queue.put(task_id)
-            
-            # Start background processing
-            asyncio.create_task(self._process_try_on(task_id))
+            self._queues[priority].append((time.monotonic(), task_id))
+            self._queued.release()
             
             logger.info("Virtual try-on started", task_id=task_id, user_id=user_id)
             return task_id
@@ -71,23 +168,22 @@ class VirtualTryOnService:
     async def get_status(self, task_id: str, user_id: str) -> Dict[str, Any]:
         """Get try-on task status"""
         try:
-            if task_id not in self.active_tasks:
+            task = self._decode_task(await self.redis.hgetall(_TASK_KEY.format(task_id)))
+            if task is None:
                 raise ValueError("Task not found")
             
-            task = self.active_tasks[task_id]
-            
             # Verify user ownership
-            if task.user_id != user_id:
+            if task["user_id"] != user_id:
                 raise ValueError("Not authorized to access this task")
             
             return {
                 "task_id": task_id,
-                "status": task.status,
-                "progress": task.progress,
-                "result_url": task.result_url,
-                "error": task.error,
-                "created_at": task.created_at.isoformat(),
-                "updated_at": task.updated_at.isoformat()
+                "status": task["status"],
+                "progress": task["progress"],
+                "result_url": task["result_url"],
+                "error": task["error"],
+                "created_at": task["created_at"],
+                "updated_at": task["updated_at"]
             }
             
         except Exception as e:
@@ -102,84 +198,187 @@ class VirtualTryOnService:
     ) -> Dict[str, Any]:
         """Predict fit for product on avatar"""
         try:
-            logger.info("Predicting fit", avatar_id=avatar_id, product_id=product_id, user_id=user_id)
-            
-            # Get avatar data
-            avatar_data = await self._get_avatar_data(avatar_id, user_id)
-            if not avatar_data:
-                raise ValueError("Avatar not found")
+            # Identical predictions already running are joined rather than repeated
+            key = (avatar_id, product_id, user_id)
+            task = self._inflight_fits.get(key)
+            if task is None:
+                task = asyncio.create_task(self._run_fit_prediction(avatar_id, product_id, user_id))
+                self._inflight_fits[key] = task
+                task.add_done_callback(lambda _: self._inflight_fits.pop(key, None))
             
-            # Get product data
-            product_data = await self._get_product_data(product_id)
-            if not product_data:
-                raise ValueError("Product not found")
-            
-            # Analyze fit using ML model
-            fit_prediction = await self._analyze_fit(avatar_data, product_data)
-            
-            logger.info("Fit prediction completed", avatar_id=avatar_id, product_id=product_id)
-            return fit_prediction
+            # Shielded so one caller disconnecting does not cancel the others
+            return await asyncio.shield(task)
             
         except Exception as e:
             logger.error("Fit prediction failed", error=str(e), avatar_id=avatar_id, product_id=product_id)
             raise
     
+    async def _run_fit_prediction(
+        self,
+        avatar_id: str,
+        product_id: str,
+        user_id: str
+    ) -> Dict[str, Any]:
+        """Load the avatar and product and run fit analysis on them"""
+        logger.info("Predicting fit", avatar_id=avatar_id, product_id=product_id, user_id=user_id)
+        
+        # Get avatar and product data concurrently
+        avatar_data, product_data = await asyncio.gather(
+            self._get_avatar_data(avatar_id, user_id),
+            self._get_product_data(product_id)
+        )
+        if not avatar_data:
+            raise ValueError("Avatar not found")
+        if not product_data:
+            raise ValueError("Product not found")
+        
+        # Analyze fit using ML model
+        fit_prediction = await self._analyze_fit(avatar_data, product_data)
+        
+        logger.info("Fit prediction completed", avatar_id=avatar_id, product_id=product_id)
+        return fit_prediction
+    
+    async def _worker(self):
+        """Process queued try-on tasks one at a time"""
+        while True:
+            await self._queued.acquire()
+            task_id = self._next_queued()
+            self._queue_slots.release()
+            # A failure here must not end the worker, or the pool shrinks for good
+            try:
+                await self._process_try_on(task_id)
+            except Exception:
+                logger.exception("Try-on worker failed to process task", task_id=task_id)
+    
+    def _next_queued(self) -> str:
+        """Pop the next task, preferring interactive work without starving batch work"""
+        interactive, batch = self._queues["interactive"], self._queues["batch"]
+        serve_batch = bool(batch) and (
+            not interactive
+            or self._interactive_streak >= _INTERACTIVE_WEIGHT
+            or time.monotonic() - batch[0][0] > _BATCH_MAX_WAIT_SECONDS
+        )
+        if serve_batch:
+            self._interactive_streak = 0
+            return batch.popleft()[1]
+        self._interactive_streak += 1
+        return interactive.popleft()[1]
+    
     async def _process_try_on(self, task_id: str):
         """Process virtual try-on task"""
+        task_log = logger.bind(task_id=task_id)
         try:
             task = self.active_tasks[task_id]
             
             # Update progress
-            task.progress = 10
-            task.updated_at = datetime.utcnow()
+            await self._update_task(task, progress=10, updated_at=datetime.utcnow())
             
-            # Get avatar data
-            avatar_data = await self._get_avatar_data(task.avatar_id, task.user_id)
+            # Get avatar and product data concurrently
+            avatar_data, product_data = await asyncio.gather(
+                self._get_avatar_data(task.avatar_id, task.user_id),
+                self._get_product_data(task.product_id)
+            )
             if not avatar_data:
                 raise ValueError("Avatar not found")
-            
-            task.progress = 20
-            
-            # Get product data
-            product_data = await self._get_product_data(task.product_id)
             if not product_data:
                 raise ValueError("Product not found")
             
-            task.progress = 30
+            await self._update_task(task, progress=30)
             
             # Download product image if needed
             if task.product_url and not product_data.get("image_url"):
                 product_image = await self._download_product_image(task.product_url)
                 product_data["image_url"] = product_image
             
-            task.progress = 40
+            await self._update_task(task, progress=40)
             
             # Perform virtual try-on using Azure ML
             try_on_result = await self._perform_virtual_tryon(avatar_data, product_data, task.settings)
             
-            task.progress = 80
-            
-            # Upload result to Azure Blob Storage
-            result_url = await self._upload_tryon_result(try_on_result, task_id)
-            
-            task.progress = 100
-            task.status = "completed"
-            task.result_url = result_url
-            task.updated_at = datetime.utcnow()
+            # Upload result to Azure Blob Storage while progress is recorded
+            _, result_url = await asyncio.gather(
+                self._update_task(task, progress=80),
+                self._upload_tryon_result(try_on_result, task_id)
+            )
             
-            # Save to database
+            # Save to database before publishing completion, so pollers never
+            # see a completed result that then fails to persist
+            completion = {
+                "progress": 100,
+                "status": "completed",
+                "result_url": result_url,
+                "updated_at": datetime.utcnow()
+            }
+            for name, value in completion.items():
+                setattr(task, name, value)
             await self._save_tryon_result(task)
+            await self._update_task(task, **completion)
             
-            logger.info("Virtual try-on completed", task_id=task_id, result_url=result_url)
+            task_log.info("Virtual try-on completed", result_url=result_url)
             
         except Exception as e:
-            logger.error("Virtual try-on processing failed", error=str(e), task_id=task_id)
+            task_log.error("Virtual try-on processing failed", error=str(e))
             
             if task_id in self.active_tasks:
-                task = self.active_tasks[task_id]
-                task.status = "failed"
-                task.error = str(e)
-                task.updated_at = datetime.utcnow()
+                await self._update_task(
+                    self.active_tasks[task_id],
+                    status="failed",
+                    error=str(e),
+                    updated_at=datetime.utcnow()
+                )
+        
+        finally:
+            self.active_tasks.pop(task_id, None)
+    
+    async def _update_task(self, task: TryOnTask, **fields: Any):
+        """Apply field changes to a task and mirror them into its Redis hash, refreshing its TTL"""
+        for name, value in fields.items():
+            setattr(task, name, value)
+        key = _TASK_KEY.format(task.id)
+        ttl = _TASK_TTL_SECONDS if task.status in _TERMINAL_STATUSES else _ACTIVE_TASK_TTL_SECONDS
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(key, mapping=self._encode_task(fields))
+            pipe.expire(key, ttl)
+            await pipe.execute()
+    
+    async def _heartbeat(self):
+        """Keep the short TTL of this worker's queued and running tasks from lapsing"""
+        while True:
+            await asyncio.sleep(_TASK_HEARTBEAT_SECONDS)
+            if not self.active_tasks:
+                continue
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for task_id in list(self.active_tasks):
+                        pipe.expire(_TASK_KEY.format(task_id), _ACTIVE_TASK_TTL_SECONDS)
+                    await pipe.execute()
+            except Exception as e:
+                logger.error("Failed to refresh try-on task TTLs", error=str(e))
+    
+    @staticmethod
+    def _encode_task(task: Dict[str, Any]) -> Dict[str, Any]:
+        """Flatten task fields into Redis hash fields"""
+        encoded = {}
+        for key, value in task.items():
+            if key == "settings":
+                encoded[key] = orjson.dumps(value).decode()
+            elif isinstance(value, datetime):
+                encoded[key] = value.isoformat()
+            elif value is None:
+                encoded[key] = ''
+            else:
+                encoded[key] = value
+        return encoded
+    
+    @staticmethod
+    def _decode_task(raw: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        """Rebuild task fields from Redis hash fields; timestamps stay ISO strings"""
+        if not raw:
+            return None
+        task: Dict[str, Any] = {key: (raw.get(key) or None) for key in _TASK_FIELDS}
+        task["settings"] = orjson.loads(task["settings"]) if task["settings"] else {}
+        task["progress"] = int(task["progress"] or 0)
+        return task
     
     async def _get_avatar_data(self, avatar_id: str, user_id: str) -> Optional[Dict[str, Any]]:
         """Get avatar data from database"""
@@ -211,13 +410,18 @@ class VirtualTryOnService:
             return None
     
     async def _get_product_data(self, product_id: str) -> Optional[Dict[str, Any]]:
-        """Get product data from database"""
+        """Get the product fields try-on and fit analysis use, from the cache when recently read"""
+        # Callers add fields to the returned dict, so hand out copies
+        cached = self._product_cache.get(product_id)
+        if cached is not None:
+            return dict(cached)
+        
         try:
             db = get_database()
             
             # Query product data
             query = """
-                SELECT id, name, description, price, image_url, category, platform, specifications
+                SELECT id, image_url, category, specifications
                 FROM products
                 WHERE id = $1
             """
@@ -225,16 +429,14 @@ class VirtualTryOnService:
             result = await db.fetchrow(query, product_id)
             
             if result:
-                return {
+                product = {
                     "id": result["id"],
-                    "name": result["name"],
-                    "description": result["description"],
-                    "price": result["price"],
                     "image_url": result["image_url"],
                     "category": result["category"],
-                    "platform": result["platform"],
                     "specifications": result["specifications"]
                 }
+                self._product_cache[product_id] = product
+                return dict(product)
             
             return None
             
@@ -245,23 +447,23 @@ class VirtualTryOnService:
     async def _download_product_image(self, product_url: str) -> str:
         """Download product image and upload to Azure Blob Storage"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(product_url) as response:
-                    if response.status == 200:
-                        image_data = await response.read()
-                        
-                        # Upload to Azure Blob Storage
-                        blob_name = f"product-images/{uuid.uuid4()}.jpg"
-                        blob_url = await self.azure_client.upload_blob(
-                            container_name="product-images",
-                            blob_name=blob_name,
-                            data=image_data,
-                            content_type="image/jpeg"
-                        )
-                        
-                        return blob_url
-                    else:
-                        raise ValueError(f"Failed to download image: {response.status}")
+            session = await self._get_session()
+            async with session.get(product_url) as response:
+                if response.status == 200:
+                    image_data = await response.read()
+                    
+                    # Upload to Azure Blob Storage
+                    blob_name = f"product-images/{uuid.uuid4()}.jpg"
+                    blob_url = await self.azure_client.upload_blob(
+                        container_name="product-images",
+                        blob_name=blob_name,
+                        data=image_data,
+                        content_type="image/jpeg"
+                    )
+                    
+                    return blob_url
+                else:
+                    raise ValueError(f"Failed to download image: {response.status}")
                         
         except Exception as e:
             logger.error("Failed to download product image", error=str(e), product_url=product_url)
@@ -271,7 +473,7 @@ class VirtualTryOnService:
         self,
         avatar_data: Dict[str, Any],
         product_data: Dict[str, Any],
-        settings: Dict[str, Any]
+        tryon_settings: Dict[str, Any]
     ) -> bytes:
         """Perform virtual try-on using Azure ML model"""
         try:
@@ -281,27 +483,18 @@ class VirtualTryOnService:
                 "product_image_url": product_data["image_url"],
                 "body_measurements": avatar_data["body_measurements"],
                 "product_category": product_data["category"],
-                "settings": settings
+                "settings": tryon_settings
             }
             
             # Call Azure ML endpoint
-            ml_endpoint_url = f"{settings.AZURE_ML_ENDPOINT}/virtual-tryon"
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    ml_endpoint_url,
-                    json=input_data,
-                    headers={
-                        "Authorization": f"Bearer {settings.AZURE_ML_API_KEY}",
-                        "Content-Type": "application/json"
-                    }
-                ) as response:
-                    if response.status == 200:
-                        result_data = await response.read()
-                        return result_data
-                    else:
-                        error_text = await response.text()
-                        raise ValueError(f"ML model failed: {error_text}")
+            session = await self._get_session()
+            async with session.post(self._tryon_url, json=input_data, headers=self._auth_headers) as response:
+                if response.status == 200:
+                    result_data = await response.read()
+                    return result_data
+                else:
+                    error_text = await response.text()
+                    raise ValueError(f"ML model failed: {error_text}")
                         
         except Exception as e:
             logger.error("Virtual try-on ML processing failed", error=str(e))
@@ -322,23 +515,14 @@ class VirtualTryOnService:
             }
             
             # Call Azure ML endpoint for fit analysis
-            ml_endpoint_url = f"{settings.AZURE_ML_ENDPOINT}/fit-analysis"
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    ml_endpoint_url,
-                    json=input_data,
-                    headers={
-                        "Authorization": f"Bearer {settings.AZURE_ML_API_KEY}",
-                        "Content-Type": "application/json"
-                    }
-                ) as response:
-                    if response.status == 200:
-                        fit_data = await response.json()
-                        return fit_data
-                    else:
-                        error_text = await response.text()
-                        raise ValueError(f"Fit analysis failed: {error_text}")
+            session = await self._get_session()
+            async with session.post(self._fit_url, json=input_data, headers=self._auth_headers) as response:
+                if response.status == 200:
+                    fit_data = await response.json(loads=orjson.loads)
+                    return fit_data
+                else:
+                    error_text = await response.text()
+                    raise ValueError(f"Fit analysis failed: {error_text}")
                         
         except Exception as e:
             logger.error("Fit analysis failed", error=str(e))
@@ -380,16 +564,12 @@ class VirtualTryOnService:
                 task.avatar_id,
                 task.product_id,
                 task.result_url,
-                json.dumps(task.settings),
+                orjson.dumps(task.settings).decode(),
                 task.status,
                 task.created_at,
                 task.updated_at
             )
             
-            # Clean up active task
-            if task.id in self.active_tasks:
-                del self.active_tasks[task.id]
-                
         except Exception as e:
             logger.error("Failed to save try-on result", error=str(e), task_id=task.id)
             raise
@@ -429,22 +609,3 @@ class VirtualTryOnService:
         except Exception as e:
             logger.error("Failed to get try-on history", error=str(e), user_id=user_id)
             return []
-    
-    async def cleanup_old_tasks(self, days: int = 7):
-        """Clean up old completed tasks"""
-        try:
-            cutoff_date = datetime.utcnow() - timedelta(days=days)
-            
-            # Remove old tasks from memory
-            tasks_to_remove = [
-                task_id for task_id, task in self.active_tasks.items()
-                if task.updated_at < cutoff_date
-            ]
-            
-            for task_id in tasks_to_remove:
-                del self.active_tasks[task_id]
-            
-            logger.info("Cleaned up old tasks", removed_count=len(tasks_to_remove))
-            
-        except Exception as e:
-            logger.error("Failed to cleanup old tasks", error=str(e)) 
\ No newline at end of file
@@ -2,45 +2,91 @@
 Structured logging configuration for Wyoiwyget AI Services
 """
 
+import atexit
+import itertools
+import os
+import queue
 import sys
 import logging
-from typing import Any, Dict
+import traceback
+from collections import defaultdict
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, DefaultDict, Dict
+import orjson
 import structlog
 from structlog.stdlib import LoggerFactory
 
+# Root log level, read from the environment once at import
+_LOG_LEVEL = getattr(logging, os.environ.get("LOG_LEVEL", "INFO").upper(), logging.INFO)
+
+# INFO helpers check this first so filtered-out calls never build their event
+_ROOT_LOGGER = logging.getLogger()
+
+# log_sampled emits one in this many calls, counted separately per event
+_LOG_SAMPLE_EVERY = max(1, int(os.environ.get("LOG_SAMPLE_EVERY", "64")))
+_sample_counters: DefaultDict[str, "itertools.count[int]"] = defaultdict(itertools.count)
+
+
+def _orjson_dumps(obj: Any, **kwargs: Any) -> str:
+    """Serialize a log event with orjson, falling back to str() for unknown types and non-str keys"""
+    return orjson.dumps(
+        obj,
+        default=str,
+        option=orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+    ).decode()
+
+
+class _EventQueueHandler(QueueHandler):
+    """Queue records as-is so structlog event dicts are rendered by the listener thread"""
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
 
 def setup_logging() -> None:
     """Setup structured logging configuration"""
     
-    # Configure structlog
+    # Configure structlog; calls below _LOG_LEVEL return at the wrapper without building
+    # an event dict, and rendering happens in the formatter
     structlog.configure(
         processors=[
-            structlog.stdlib.filter_by_level,
             structlog.stdlib.add_logger_name,
             structlog.stdlib.add_log_level,
             structlog.stdlib.PositionalArgumentsFormatter(),
             structlog.processors.TimeStamper(fmt="iso"),
-            structlog.processors.StackInfoRenderer(),
             structlog.processors.format_exc_info,
-            structlog.processors.UnicodeDecoder(),
-            structlog.processors.JSONRenderer()
+            structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
         ],
         context_class=dict,
         logger_factory=LoggerFactory(),
-        wrapper_class=structlog.stdlib.BoundLogger,
+        wrapper_class=structlog.make_filtering_bound_logger(_LOG_LEVEL),
         cache_logger_on_first_use=True,
     )
     
+    # JSON rendering and the stdout write run on a background listener thread
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(structlog.stdlib.ProcessorFormatter(
+        processors=[
+            structlog.stdlib.ProcessorFormatter.remove_processors_meta,
+            structlog.processors.UnicodeDecoder(),
+            structlog.processors.JSONRenderer(serializer=_orjson_dumps),
+        ],
+        foreign_pre_chain=[
+            structlog.stdlib.add_logger_name,
+            structlog.stdlib.add_log_level,
+            structlog.processors.TimeStamper(fmt="iso"),
+        ],
+    ))
+    log_queue: queue.Queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    
     # Configure standard library logging
     logging.basicConfig(
-        format="%(message)s",
-        stream=sys.stdout,
-        level=logging.INFO,
+        handlers=[_EventQueueHandler(log_queue)],
+        level=_LOG_LEVEL,
     )
-    
-    # Set log level based on environment
-    log_level = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
-    logging.getLogger().setLevel(log_level)
 
 
 def get_logger(name: str = None) -> structlog.BoundLogger:
@@ -48,8 +94,19 @@ def get_logger(name: str = None) -> structlog.BoundLogger:
     return structlog.get_logger(name)
 
 
+def log_sampled(logger: structlog.BoundLogger, event: str, **kwargs: Any) -> None:
+    """Log a high-volume INFO event for one call in every _LOG_SAMPLE_EVERY"""
+    if next(_sample_counters[event]) % _LOG_SAMPLE_EVERY:
+        return
+    
+    logger.info(event, sample_rate=_LOG_SAMPLE_EVERY, **kwargs)
+
+
 def log_request(request_data: Dict[str, Any], logger: structlog.BoundLogger = None) -> None:
     """Log incoming request data"""
+    if not _ROOT_LOGGER.isEnabledFor(logging.INFO):
+        return
+    
     if logger is None:
         logger = get_logger()
     
@@ -65,6 +122,9 @@ def log_request(request_data: Dict[str, Any], logger: structlog.BoundLogger = No
 
 def log_response(response_data: Dict[str, Any], logger: structlog.BoundLogger = None) -> None:
     """Log outgoing response data"""
+    if not _ROOT_LOGGER.isEnabledFor(logging.INFO):
+        return
+    
     if logger is None:
         logger = get_logger()
     
@@ -84,7 +144,10 @@ def log_error(error: Exception, context: Dict[str, Any] = None, logger: structlo
     log_data = {
         "error_type": type(error).__name__,
         "error_message": str(error),
-        "error_traceback": getattr(error, "__traceback__", None),
+        # Rendered to text so the record does not keep the traceback's frames alive
+        "error_traceback": (
+            "".join(traceback.format_exception(error)) if error.__traceback__ is not None else None
+        ),
     }
     
     if context:
@@ -95,6 +158,9 @@ def log_error(error: Exception, context: Dict[str, Any] = None, logger: structlo
 
 def log_ai_task_start(task_type: str, task_id: str, user_id: str, logger: structlog.BoundLogger = None) -> None:
     """Log AI task start"""
+    if not _ROOT_LOGGER.isEnabledFor(logging.INFO):
+        return
+    
     if logger is None:
         logger = get_logger()
     
@@ -108,6 +174,9 @@ def log_ai_task_start(task_type: str, task_id: str, user_id: str, logger: struct
 
 def log_ai_task_complete(task_type: str, task_id: str, user_id: str, duration: float, logger: structlog.BoundLogger = None) -> None:
     """Log AI task completion"""
+    if not _ROOT_LOGGER.isEnabledFor(logging.INFO):
+        return
+    
     if logger is None:
         logger = get_logger()
     
@@ -137,6 +206,9 @@ def log_ai_task_error(task_type: str, task_id: str, user_id: str, error: Excepti
 
 def log_azure_service_call(service: str, operation: str, duration: float, success: bool, logger: structlog.BoundLogger = None) -> None:
     """Log Azure service API calls"""
+    if success and not _ROOT_LOGGER.isEnabledFor(logging.INFO):
+        return
+    
     if logger is None:
         logger = get_logger()
     
@@ -153,6 +225,9 @@ def log_azure_service_call(service: str, operation: str, duration: float, succes
 
 def log_file_upload(file_info: Dict[str, Any], user_id: str, logger: structlog.BoundLogger = None) -> None:
     """Log file upload events"""
+    if not _ROOT_LOGGER.isEnabledFor(logging.INFO):
+        return
+    
     if logger is None:
         logger = get_logger()
     
@@ -167,6 +242,9 @@ def log_file_upload(file_info: Dict[str, Any], user_id: str, logger: structlog.B
 
 def log_model_inference(model: str, input_size: Dict[str, Any], output_size: Dict[str, Any], duration: float, logger: structlog.BoundLogger = None) -> None:
     """Log ML model inference"""
+    if not _ROOT_LOGGER.isEnabledFor(logging.INFO):
+        return
+    
     if logger is None:
         logger = get_logger()
     
@@ -0,0 +1,143 @@
+"""
+ONNX Runtime helpers for image-to-image feature models
+"""
+
+import argparse
+import os
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+import cv2
+import numpy as np
+import onnxruntime as ort
+
+# Preferred execution providers, best first
+GPU_PROVIDERS = ("CUDAExecutionProvider", "CPUExecutionProvider")
+CPU_PROVIDERS = ("CPUExecutionProvider",)
+
+# Input size used when a model declares dynamic spatial dimensions
+DEFAULT_INPUT_SIZE = (1024, 1024)
+
+
+def int8_model_path(model_path: str) -> str:
+    """Return where the int8 variant of a model is stored (model.onnx -> model.int8.onnx)"""
+    stem, ext = os.path.splitext(model_path)
+    return f"{stem}.int8{ext}"
+
+
+def create_session(model_path: str, use_gpu: bool = True, prefer_int8: bool = True) -> ort.InferenceSession:
+    """Create an inference session on the best available execution provider
+
+    On CPU the int8 variant produced by quantize_int8() is used when present;
+    the FP32 model remains the fallback and is always used on GPU.
+    """
+    available = set(ort.get_available_providers())
+    preferred = GPU_PROVIDERS if use_gpu else CPU_PROVIDERS
+    providers = [provider for provider in preferred if provider in available]
+
+    if prefer_int8 and providers[0] == "CPUExecutionProvider" and os.path.exists(int8_model_path(model_path)):
+        model_path = int8_model_path(model_path)
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+    return ort.InferenceSession(model_path, sess_options=options, providers=providers)
+
+
+def _input_size(meta: ort.NodeArg) -> Tuple[int, int]:
+    """Return the (width, height) a model input expects"""
+    height, width = meta.shape[2], meta.shape[3]
+    if isinstance(height, int) and isinstance(width, int):
+        return width, height
+    return DEFAULT_INPUT_SIZE
+
+
+def decode_image(data: bytes, meta: ort.NodeArg) -> np.ndarray:
+    """Decode an encoded image into an NCHW tensor matching a model input"""
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image")
+
+    image = cv2.resize(image, _input_size(meta), interpolation=cv2.INTER_AREA)
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    dtype = np.float16 if meta.type == "tensor(float16)" else np.float32
+    tensor = image.transpose(2, 0, 1)[np.newaxis].astype(dtype)
+    tensor /= dtype(255)
+    return np.ascontiguousarray(tensor)
+
+
+def encode_image(tensor: np.ndarray) -> bytes:
+    """Encode an NCHW tensor with values in [0, 1] as PNG bytes"""
+    image = np.clip(tensor[0].transpose(1, 2, 0) * 255, 0, 255).astype(np.uint8)
+    ok, encoded = cv2.imencode(".png", cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+    if not ok:
+        raise ValueError("Could not encode image")
+    return encoded.tobytes()
+
+
+def run_image_model(session: ort.InferenceSession, images: Sequence[bytes]) -> bytes:
+    """Run a model whose inputs are images, in declaration order, and return its first output as PNG"""
+    feeds = {
+        meta.name: decode_image(data, meta)
+        for meta, data in zip(session.get_inputs(), images)
+    }
+
+    if "CUDAExecutionProvider" not in session.get_providers():
+        return encode_image(session.run(None, feeds)[0])
+
+    # Bind inputs on the device up front so host-to-device copies are not repeated inside run()
+    binding = session.io_binding()
+    for name, tensor in feeds.items():
+        binding.bind_ortvalue_input(name, ort.OrtValue.ortvalue_from_numpy(tensor, "cuda", 0))
+    binding.bind_output(session.get_outputs()[0].name, "cuda")
+    session.run_with_iobinding(binding)
+    return encode_image(binding.copy_outputs_to_cpu()[0])
+
+
+def quantize_int8(model_path: str, image_paths: Sequence[str], output_path: Optional[str] = None) -> str:
+    """Statically quantize a model to int8 QDQ format using calibration images"""
+    # Quantization tooling is only needed offline, so it is not imported with the serving path
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    class ImageCalibrationReader(CalibrationDataReader):
+        """Feeds representative images to static quantization, one image per model input"""
+
+        def __init__(self, model_path: str, image_paths: Sequence[str]):
+            inputs = ort.InferenceSession(model_path, providers=list(CPU_PROVIDERS)).get_inputs()
+            self._image_paths = list(image_paths)
+            self._inputs = inputs
+            self._samples: Optional[Iterator[Dict[str, np.ndarray]]] = None
+
+        def _iter_samples(self) -> Iterator[Dict[str, np.ndarray]]:
+            for path in self._image_paths:
+                with open(path, "rb") as f:
+                    data = f.read()
+                yield {meta.name: decode_image(data, meta) for meta in self._inputs}
+
+        def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+            if self._samples is None:
+                self._samples = self._iter_samples()
+            return next(self._samples, None)
+
+        def rewind(self) -> None:
+            self._samples = None
+
+    output_path = output_path or int8_model_path(model_path)
+    quantize_static(
+        model_input=model_path,
+        model_output=output_path,
+        calibration_data_reader=ImageCalibrationReader(model_path, image_paths),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QInt8,
+        weight_type=QuantType.QInt8,
+    )
+    return output_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantize an ONNX image model to int8")
+    parser.add_argument("model", help="Path to the FP32 ONNX model")
+    parser.add_argument("images", nargs="+", help="Representative calibration images")
+    parser.add_argument("--output", help="Output path (defaults to <model>.int8.onnx)")
+    args = parser.parse_args()
+
+    print(quantize_int8(args.model, args.images, args.output))
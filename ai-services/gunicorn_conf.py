@@ -0,0 +1,27 @@
+"""
+Gunicorn configuration for Wyoiwyget AI Services
+"""
+
+import multiprocessing
+import os
+
+from uvicorn.workers import UvicornWorker
+
+
+class UvloopWorker(UvicornWorker):
+    """Uvicorn worker that requires uvloop and httptools instead of falling back to asyncio"""
+    
+    CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, "loop": "uvloop", "http": "httptools"}
+
+
+# Each worker runs its own event loop and builds its own services, database pool
+# and Redis connections in the FastAPI lifespan, so size DB limits for all workers.
+# Workers also load their own ONNX sessions, numba kernels and a core-sized image
+# thread pool, so keep the count small rather than the I/O-bound 2 * cores + 1
+worker_class = "gunicorn_conf.UvloopWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", min(2, multiprocessing.cpu_count())))
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8001')}"
+keepalive = 5
+timeout = 120
+graceful_timeout = 30
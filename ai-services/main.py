@@ -3,18 +3,23 @@ Wyoiwyget AI Services - Azure ML Backend
 Main FastAPI application for AI-powered avatar generation and virtual try-on
 """
 
+import asyncio
+import datetime
+import hashlib
 import os
+import time
 import logging
 from contextlib import asynccontextmanager
-from typing import Dict, Any, Optional
+from typing import Annotated, Dict, Any, Optional
 
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, UploadFile, File
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import uvicorn
-from pydantic import BaseModel, Field
+from cachetools import TTLCache
+from jose import jwt
+from pydantic import BaseModel, ConfigDict, Field
 import structlog
 
 from app.core.config import settings
@@ -25,7 +30,7 @@ from app.services.virtual_tryon_service import VirtualTryOnService
 from app.services.body_measurement_service import BodyMeasurementService
 from app.services.product_matching_service import ProductMatchingService
 from app.utils.azure_client import AzureClient
-from app.utils.logging import setup_logging
+from app.utils.logging import log_sampled, setup_logging
 
 # Setup structured logging
 setup_logging()
@@ -34,23 +39,58 @@ logger = structlog.get_logger()
 # Security
 security = HTTPBearer()
 
+# Verified (user, token expiry) pairs keyed by token digest; the TTL keeps revoked tokens
+# short-lived and hits past the token's own exp are treated as misses
+_TOKEN_CACHE_SIZE = 4096
+_TOKEN_CACHE_TTL_SECONDS = 60
+_verified_tokens: TTLCache = TTLCache(maxsize=_TOKEN_CACHE_SIZE, ttl=_TOKEN_CACHE_TTL_SECONDS)
+
+# Requests this worker is currently serving; past MAX_INFLIGHT_REQUESTS new ones get a 503
+# telling the client when to retry
+_inflight_requests = 0
+_BUSY_RETRY_AFTER_SECONDS = 1
+
+# How often the cached /health payload is rebuilt
+_HEALTH_REFRESH_SECONDS = 5
+
+# Leading bytes of the image formats we decode; WebP also carries "WEBP" at offset 8
+_IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"RIFF", "image/webp"),
+)
+_IMAGE_SNIFF_BYTES = 12
+
+def _sniff_image_type(head: bytes) -> Optional[str]:
+    """Return the MIME type implied by an upload's leading bytes, or None if unrecognized"""
+    for signature, content_type in _IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            if content_type == "image/webp" and head[8:12] != b"WEBP":
+                return None
+            return content_type
+    return None
+
 # Pydantic models
 class BodyMeasurementRequest(BaseModel):
     """Request model for body measurements"""
-    height: float = Field(..., ge=100, le=250, description="Height in cm")
-    weight: float = Field(..., ge=30, le=300, description="Weight in kg")
-    chest: Optional[float] = Field(None, ge=60, le=150, description="Chest circumference in cm")
-    waist: Optional[float] = Field(None, ge=50, le=150, description="Waist circumference in cm")
-    hips: Optional[float] = Field(None, ge=60, le=150, description="Hip circumference in cm")
-    shoulder_width: Optional[float] = Field(None, ge=30, le=60, description="Shoulder width in cm")
-    arm_length: Optional[float] = Field(None, ge=50, le=100, description="Arm length in cm")
-    inseam: Optional[float] = Field(None, ge=50, le=100, description="Inseam length in cm")
-    shoe_size: Optional[float] = Field(None, ge=30, le=50, description="Shoe size (EU)")
+    model_config = ConfigDict(extra="forbid", frozen=True)
+    
+    height: float = Field(..., ge=100, le=250, strict=True, description="Height in cm")
+    weight: float = Field(..., ge=30, le=300, strict=True, description="Weight in kg")
+    chest: Optional[float] = Field(None, ge=60, le=150, strict=True, description="Chest circumference in cm")
+    waist: Optional[float] = Field(None, ge=50, le=150, strict=True, description="Waist circumference in cm")
+    hips: Optional[float] = Field(None, ge=60, le=150, strict=True, description="Hip circumference in cm")
+    shoulder_width: Optional[float] = Field(None, ge=30, le=60, strict=True, description="Shoulder width in cm")
+    arm_length: Optional[float] = Field(None, ge=50, le=100, strict=True, description="Arm length in cm")
+    inseam: Optional[float] = Field(None, ge=50, le=100, strict=True, description="Inseam length in cm")
+    shoe_size: Optional[float] = Field(None, ge=30, le=50, strict=True, description="Shoe size (EU)")
     body_type: Optional[str] = Field(None, description="Body type (slim, athletic, average, curvy, plus_size)")
     gender: Optional[str] = Field(None, description="Gender (male, female, other)")
 
 class AvatarGenerationRequest(BaseModel):
     """Request model for avatar generation"""
+    model_config = ConfigDict(extra="forbid", frozen=True)
+    
     user_id: str = Field(..., description="User ID")
     body_measurements: BodyMeasurementRequest
     face_image_url: Optional[str] = Field(None, description="URL to face image")
@@ -59,6 +99,8 @@ class AvatarGenerationRequest(BaseModel):
 
 class VirtualTryOnRequest(BaseModel):
     """Request model for virtual try-on"""
+    model_config = ConfigDict(extra="forbid", frozen=True)
+    
     user_id: str = Field(..., description="User ID")
     avatar_id: str = Field(..., description="Avatar ID")
     product_id: str = Field(..., description="Product ID")
@@ -67,6 +109,8 @@ class VirtualTryOnRequest(BaseModel):
 
 class ProductMatchingRequest(BaseModel):
     """Request model for product matching"""
+    model_config = ConfigDict(extra="forbid", frozen=True)
+    
     source_product_url: str = Field(..., description="Source product URL")
     target_platforms: list[str] = Field(..., description="Target platforms to search")
     matching_criteria: Optional[Dict[str, Any]] = Field(default_factory=dict, description="Matching criteria")
@@ -77,6 +121,41 @@ class HealthResponse(BaseModel):
     version: str
     timestamp: str
     services: Dict[str, str]
+    inflight_requests: int = Field(..., description="Requests in flight as of the last health refresh (up to _HEALTH_REFRESH_SECONDS stale)")
+
+def _build_health_payload(app: FastAPI) -> bytes:
+    """Probe service health and serialize the /health response"""
+    services_status = {
+        "database": "healthy",
+        "azure_storage": "healthy",
+        "azure_openai": "healthy",
+        "avatar_service": "healthy",
+        "virtual_tryon_service": "healthy"
+    }
+    
+    # Check Azure services
+    try:
+        if not app.state.azure_client.is_initialized():
+            services_status["azure_storage"] = "unhealthy"
+            services_status["azure_openai"] = "unhealthy"
+    except Exception as e:
+        logger.error("Azure services health check failed", error=str(e))
+        services_status["azure_storage"] = "unhealthy"
+        services_status["azure_openai"] = "unhealthy"
+    
+    return HealthResponse(
+        status="healthy",
+        version="1.0.0",
+        timestamp=datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        services=services_status,
+        inflight_requests=_inflight_requests
+    ).model_dump_json().encode()
+
+async def _refresh_health(app: FastAPI):
+    """Periodically rebuild the cached /health payload"""
+    while True:
+        await asyncio.sleep(_HEALTH_REFRESH_SECONDS)
+        app.state.health_payload = _build_health_payload(app)
 
 # Application lifespan
 @asynccontextmanager
@@ -90,6 +169,7 @@ async def lifespan(app: FastAPI):
     
     # Initialize Azure clients
     await AzureClient.initialize()
+    app.state.azure_client = AzureClient.get_instance()
     
     # Initialize AI services
     app.state.avatar_service = AvatarService()
@@ -97,12 +177,23 @@ async def lifespan(app: FastAPI):
     app.state.body_measurement_service = BodyMeasurementService()
     app.state.product_matching_service = ProductMatchingService()
     
+    # Open connections now rather than inside the first request
+    await app.state.body_measurement_service.warm_up()
+    
+    app.state.health_payload = _build_health_payload(app)
+    health_refresher = asyncio.create_task(_refresh_health(app))
+    
     logger.info("Wyoiwyget AI Services started successfully")
     
     yield
     
     # Shutdown
     logger.info("Shutting down Wyoiwyget AI Services")
+    health_refresher.cancel()
+    await app.state.avatar_service.aclose()
+    await app.state.virtual_tryon_service.aclose()
+    await app.state.body_measurement_service.aclose()
+    await app.state.product_matching_service.aclose()
     await close_database()
     logger.info("Wyoiwyget AI Services shutdown complete")
 
@@ -113,10 +204,71 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs" if settings.ENVIRONMENT != "production" else None,
     redoc_url="/redoc" if settings.ENVIRONMENT != "production" else None,
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
-# Middleware
+class UnhandledErrorMiddleware:
+    """Answer unexpected exceptions with the global 500 response from inside CORS"""
+    
+    def __init__(self, app):
+        self.app = app
+        
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        response_started = False
+        
+        async def send_wrapper(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as exc:
+            if response_started:
+                raise
+            response = await global_exception_handler(Request(scope), exc)
+            await response(scope, receive, send)
+
+# Middleware, innermost first: unexpected errors and the in-flight limit's 503s are
+# answered inside CORS, so browsers can read them
+app.add_middleware(UnhandledErrorMiddleware)
+
+class InflightLimitMiddleware:
+    """Shed load once this worker is serving MAX_INFLIGHT_REQUESTS requests"""
+    
+    def __init__(self, app, max_inflight):
+        self.app = app
+        self.max_inflight = max_inflight
+        
+    async def __call__(self, scope, receive, send):
+        global _inflight_requests
+        if scope["type"] != "http" or scope["path"] == "/health":
+            await self.app(scope, receive, send)
+            return
+        
+        if _inflight_requests >= self.max_inflight:
+            response = ORJSONResponse(
+                status_code=503,
+                content={"detail": "Server busy, retry later"},
+                headers={"Retry-After": str(_BUSY_RETRY_AFTER_SECONDS)}
+            )
+            await response(scope, receive, send)
+            return
+        
+        _inflight_requests += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _inflight_requests -= 1
+
+app.add_middleware(InflightLimitMiddleware, max_inflight=settings.MAX_INFLIGHT_REQUESTS)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.ALLOWED_ORIGINS,
@@ -125,240 +277,252 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class HostAllowlistMiddleware:
+    """Reject HTTP and websocket requests whose Host header is not allowed before any other middleware runs"""
+    
+    def __init__(self, app, allowed_hosts):
+        self.app = app
+        self.allow_any = "*" in allowed_hosts
+        self.allowed_hosts = frozenset(host.encode() for host in allowed_hosts if not host.startswith("*"))
+        self.allowed_suffixes = tuple(host[1:].encode() for host in allowed_hosts if host.startswith("*."))
+        
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket") or self.allow_any:
+            await self.app(scope, receive, send)
+            return
+        
+        host = b""
+        for name, value in scope["headers"]:
+            if name == b"host":
+                host = value.split(b":", 1)[0]
+                break
+        if host in self.allowed_hosts or (self.allowed_suffixes and host.endswith(self.allowed_suffixes)):
+            await self.app(scope, receive, send)
+            return
+        
+        if scope["type"] == "websocket":
+            # Closing before accept makes the server reject the handshake
+            await send({"type": "websocket.close", "code": 1008})
+            return
+        await send({
+            "type": "http.response.start",
+            "status": 400,
+            "headers": [(b"content-type", b"text/plain; charset=utf-8"), (b"content-length", b"19")],
+        })
+        await send({"type": "http.response.body", "body": b"Invalid host header"})
+
+# Added last so it is outermost and rejects bad hosts before the rest of the stack
 app.add_middleware(
-    TrustedHostMiddleware,
+    HostAllowlistMiddleware,
     allowed_hosts=settings.ALLOWED_HOSTS
 )
 
 # Dependency for authentication
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict[str, Any]:
-    """Get current authenticated user"""
+async def get_current_user(
+    request: Request,
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)]
+) -> Dict[str, Any]:
+    """Get current authenticated user and stash it on request.state.user"""
+    token_key = hashlib.blake2b(credentials.credentials.encode(), digest_size=16).hexdigest()
+    cached = _verified_tokens.get(token_key)
+    if cached is not None and cached[1] > time.time():
+        request.state.user = cached[0]
+        return cached[0]
     try:
-        token = credentials.credentials
-        user = await verify_token(token)
-        return user
+        user = await verify_token(credentials.credentials)
     except Exception as e:
         logger.error("Authentication failed", error=str(e))
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    
+    # Only tokens with a known expiry are cached, so no entry outlives its token
+    try:
+        expires_at = float(jwt.get_unverified_claims(credentials.credentials)["exp"])
+    except Exception:
+        expires_at = 0.0
+    if expires_at > time.time():
+        _verified_tokens[token_key] = (user, expires_at)
+    request.state.user = user
+    return user
+
+CurrentUser = Annotated[Dict[str, Any], Depends(get_current_user)]
+
+# Authenticated API routes; endpoints that read current_user reuse the cached dependency result
+router = APIRouter(prefix="/api/v1", dependencies=[Depends(get_current_user)])
 
-# Health check endpoint
+# Health check endpoint; probes get the payload last built by _refresh_health
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """Health check endpoint"""
-    import datetime
-    
-    services_status = {
-        "database": "healthy",
-        "azure_storage": "healthy",
-        "azure_openai": "healthy",
-        "avatar_service": "healthy",
-        "virtual_tryon_service": "healthy"
-    }
-    
-    # Check Azure services
-    try:
-        azure_client = AzureClient.get_instance()
-        if not azure_client.is_initialized():
-            services_status["azure_storage"] = "unhealthy"
-            services_status["azure_openai"] = "unhealthy"
-    except Exception as e:
-        logger.error("Azure services health check failed", error=str(e))
-        services_status["azure_storage"] = "unhealthy"
-        services_status["azure_openai"] = "unhealthy"
-    
-    return HealthResponse(
-        status="healthy",
-        version="1.0.0",
-        timestamp=datetime.datetime.utcnow().isoformat(),
-        services=services_status
-    )
+    return Response(content=app.state.health_payload, media_type="application/json")
 
 # Body measurement analysis endpoint
-@app.post("/api/v1/body-measurements/analyze")
+@router.post("/body-measurements/analyze")
 async def analyze_body_measurements(
-    file: UploadFile = File(...),
-    current_user: Dict[str, Any] = Depends(get_current_user)
+    file: Annotated[UploadFile, File()],
+    current_user: CurrentUser
 ):
     """Analyze body measurements from uploaded image"""
-    try:
-        logger.info("Analyzing body measurements", user_id=current_user["id"])
-        
-        # Validate file
-        if not file.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="File must be an image")
-        
-        # Process image
-        body_measurement_service = app.state.body_measurement_service
-        measurements = await body_measurement_service.analyze_image(file)
-        
-        logger.info("Body measurements analyzed successfully", user_id=current_user["id"])
-        return JSONResponse(content=measurements)
-        
-    except Exception as e:
-        logger.error("Body measurement analysis failed", error=str(e), user_id=current_user["id"])
-        raise HTTPException(status_code=500, detail="Failed to analyze body measurements")
+    log = logger.bind(user_id=current_user["id"])
+    
+    # Validate file from its leading bytes; the client's content type is not trusted
+    head = await file.read(_IMAGE_SNIFF_BYTES)
+    await file.seek(0)
+    if _sniff_image_type(head) not in settings.ALLOWED_IMAGE_TYPES:
+        raise HTTPException(status_code=415, detail=f"File must be one of: {', '.join(sorted(settings.ALLOWED_IMAGE_TYPES))}")
+    
+    log.info("Analyzing body measurements")
+    
+    # Process image
+    body_measurement_service = app.state.body_measurement_service
+    measurements = await body_measurement_service.analyze_image(file)
+    
+    log.info("Body measurements analyzed successfully")
+    return ORJSONResponse(content=measurements)
 
 # Avatar generation endpoint
-@app.post("/api/v1/avatars/generate")
+@router.post("/avatars/generate")
 async def generate_avatar(
     request: AvatarGenerationRequest,
-    background_tasks: BackgroundTasks,
-    current_user: Dict[str, Any] = Depends(get_current_user)
+    current_user: CurrentUser
 ):
     """Generate AI avatar for user"""
-    try:
-        logger.info("Generating avatar", user_id=current_user["id"])
-        
-        # Validate user ownership
-        if request.user_id != current_user["id"]:
-            raise HTTPException(status_code=403, detail="Not authorized to generate avatar for this user")
-        
-        avatar_service = app.state.avatar_service
-        
-        # Start avatar generation in background
-        task_id = await avatar_service.start_generation(
-            user_id=request.user_id,
-            body_measurements=request.body_measurements.dict(),
-            face_image_url=request.face_image_url,
-            body_image_url=request.body_image_url,
-            preferences=request.preferences
-        )
-        
-        logger.info("Avatar generation started", user_id=current_user["id"], task_id=task_id)
-        return JSONResponse(content={"task_id": task_id, "status": "processing"})
-        
-    except Exception as e:
-        logger.error("Avatar generation failed", error=str(e), user_id=current_user["id"])
-        raise HTTPException(status_code=500, detail="Failed to generate avatar")
+    log = logger.bind(user_id=current_user["id"])
+    log_sampled(log, "Generating avatar")
+    
+    # Validate user ownership
+    if request.user_id != current_user["id"]:
+        raise HTTPException(status_code=403, detail="Not authorized to generate avatar for this user")
+    
+    avatar_service = app.state.avatar_service
+    
+    # Start avatar generation in background
+    task_id = await avatar_service.start_generation(
+        user_id=request.user_id,
+        body_measurements=request.body_measurements.model_dump(exclude_unset=True),
+        face_image_url=request.face_image_url,
+        body_image_url=request.body_image_url,
+        preferences=request.preferences
+    )
+    
+    log_sampled(log, "Avatar generation started", task_id=task_id)
+    return ORJSONResponse(content={"task_id": task_id, "status": "processing"})
 
 # Avatar status endpoint
-@app.get("/api/v1/avatars/{avatar_id}/status")
+@router.get("/avatars/{avatar_id}/status")
 async def get_avatar_status(
     avatar_id: str,
-    current_user: Dict[str, Any] = Depends(get_current_user)
+    current_user: CurrentUser
 ):
     """Get avatar generation status"""
-    try:
-        logger.info("Getting avatar status", user_id=current_user["id"], avatar_id=avatar_id)
-        
-        avatar_service = app.state.avatar_service
-        status = await avatar_service.get_status(avatar_id, current_user["id"])
-        
-        return JSONResponse(content=status)
-        
-    except Exception as e:
-        logger.error("Failed to get avatar status", error=str(e), user_id=current_user["id"])
-        raise HTTPException(status_code=500, detail="Failed to get avatar status")
+    log = logger.bind(user_id=current_user["id"])
+    log.info("Getting avatar status", avatar_id=avatar_id)
+    
+    avatar_service = app.state.avatar_service
+    status = await avatar_service.get_status(avatar_id, current_user["id"])
+    
+    return ORJSONResponse(content=status)
 
 # Virtual try-on endpoint
-@app.post("/api/v1/virtual-tryon")
+@router.post("/virtual-tryon")
 async def virtual_try_on(
     request: VirtualTryOnRequest,
-    background_tasks: BackgroundTasks,
-    current_user: Dict[str, Any] = Depends(get_current_user)
+    current_user: CurrentUser
 ):
     """Perform virtual try-on with product"""
-    try:
-        logger.info("Starting virtual try-on", user_id=current_user["id"], product_id=request.product_id)
-        
-        # Validate user ownership
-        if request.user_id != current_user["id"]:
-            raise HTTPException(status_code=403, detail="Not authorized to perform try-on for this user")
-        
-        virtual_tryon_service = app.state.virtual_tryon_service
-        
-        # Start virtual try-on in background
-        task_id = await virtual_tryon_service.start_try_on(
-            user_id=request.user_id,
-            avatar_id=request.avatar_id,
-            product_id=request.product_id,
-            product_url=request.product_url,
-            settings=request.try_on_settings
-        )
-        
-        logger.info("Virtual try-on started", user_id=current_user["id"], task_id=task_id)
-        return JSONResponse(content={"task_id": task_id, "status": "processing"})
-        
-    except Exception as e:
-        logger.error("Virtual try-on failed", error=str(e), user_id=current_user["id"])
-        raise HTTPException(status_code=500, detail="Failed to perform virtual try-on")
+    log = logger.bind(user_id=current_user["id"])
+    log_sampled(log, "Starting virtual try-on", product_id=request.product_id)
+    
+    # Validate user ownership
+    if request.user_id != current_user["id"]:
+        raise HTTPException(status_code=403, detail="Not authorized to perform try-on for this user")
+    
+    virtual_tryon_service = app.state.virtual_tryon_service
+    
+    # Start virtual try-on in background
+    task_id = await virtual_tryon_service.start_try_on(
+        user_id=request.user_id,
+        avatar_id=request.avatar_id,
+        product_id=request.product_id,
+        product_url=request.product_url,
+        settings=request.try_on_settings
+    )
+    
+    log_sampled(log, "Virtual try-on started", task_id=task_id)
+    return ORJSONResponse(content={"task_id": task_id, "status": "processing"})
 
 # Virtual try-on status endpoint
-@app.get("/api/v1/virtual-tryon/{task_id}/status")
+@router.get("/virtual-tryon/{task_id}/status")
 async def get_try_on_status(
     task_id: str,
-    current_user: Dict[str, Any] = Depends(get_current_user)
+    current_user: CurrentUser
 ):
     """Get virtual try-on status"""
-    try:
-        logger.info("Getting try-on status", user_id=current_user["id"], task_id=task_id)
-        
-        virtual_tryon_service = app.state.virtual_tryon_service
-        status = await virtual_tryon_service.get_status(task_id, current_user["id"])
-        
-        return JSONResponse(content=status)
-        
-    except Exception as e:
-        logger.error("Failed to get try-on status", error=str(e), user_id=current_user["id"])
-        raise HTTPException(status_code=500, detail="Failed to get try-on status")
+    log = logger.bind(user_id=current_user["id"])
+    log_sampled(log, "Getting try-on status", task_id=task_id)
+    
+    virtual_tryon_service = app.state.virtual_tryon_service
+    status = await virtual_tryon_service.get_status(task_id, current_user["id"])
+    
+    return ORJSONResponse(content=status)
 
 # Product matching endpoint
-@app.post("/api/v1/products/match")
+@router.post("/products/match")
 async def match_products(
     request: ProductMatchingRequest,
-    current_user: Dict[str, Any] = Depends(get_current_user)
+    current_user: CurrentUser
 ):
     """Match products across different platforms"""
-    try:
-        logger.info("Matching products", user_id=current_user["id"])
-        
-        product_matching_service = app.state.product_matching_service
-        
-        matches = await product_matching_service.find_matches(
-            source_url=request.source_product_url,
-            target_platforms=request.target_platforms,
-            criteria=request.matching_criteria
-        )
-        
-        logger.info("Product matching completed", user_id=current_user["id"], match_count=len(matches))
-        return JSONResponse(content={"matches": matches})
-        
-    except Exception as e:
-        logger.error("Product matching failed", error=str(e), user_id=current_user["id"])
-        raise HTTPException(status_code=500, detail="Failed to match products")
+    log = logger.bind(user_id=current_user["id"])
+    log.info("Matching products")
+    
+    product_matching_service = app.state.product_matching_service
+    
+    matches = await product_matching_service.find_matches(
+        source_url=request.source_product_url,
+        target_platforms=request.target_platforms,
+        criteria=request.matching_criteria
+    )
+    
+    log.info("Product matching completed", match_count=len(matches))
+    return ORJSONResponse(content={"matches": matches})
 
 # Fit prediction endpoint
-@app.post("/api/v1/fit/predict")
+@router.post("/fit/predict")
 async def predict_fit(
     avatar_id: str,
     product_id: str,
-    current_user: Dict[str, Any] = Depends(get_current_user)
+    current_user: CurrentUser
 ):
     """Predict fit for product on avatar"""
-    try:
-        logger.info("Predicting fit", user_id=current_user["id"], avatar_id=avatar_id, product_id=product_id)
-        
-        virtual_tryon_service = app.state.virtual_tryon_service
-        
-        fit_prediction = await virtual_tryon_service.predict_fit(
-            avatar_id=avatar_id,
-            product_id=product_id,
-            user_id=current_user["id"]
-        )
-        
-        logger.info("Fit prediction completed", user_id=current_user["id"])
-        return JSONResponse(content=fit_prediction)
-        
-    except Exception as e:
-        logger.error("Fit prediction failed", error=str(e), user_id=current_user["id"])
-        raise HTTPException(status_code=500, detail="Failed to predict fit")
+    log = logger.bind(user_id=current_user["id"])
+    log.info("Predicting fit", avatar_id=avatar_id, product_id=product_id)
+    
+    virtual_tryon_service = app.state.virtual_tryon_service
+    
+    fit_prediction = await virtual_tryon_service.predict_fit(
+        avatar_id=avatar_id,
+        product_id=product_id,
+        user_id=current_user["id"]
+    )
+    
+    log.info("Fit prediction completed")
+    return ORJSONResponse(content=fit_prediction)
+
+app.include_router(router)
 
 # Error handlers
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
-    """Global exception handler"""
-    logger.error("Unhandled exception", error=str(exc), path=request.url.path)
-    return JSONResponse(
+    """Global exception handler; endpoints let unexpected errors propagate here"""
+    user = getattr(request.state, "user", None)
+    logger.error(
+        "Unhandled exception",
+        error=str(exc),
+        error_type=type(exc).__name__,
+        path=request.url.path,
+        user_id=user["id"] if user else None
+    )
+    return ORJSONResponse(
         status_code=500,
         content={"detail": "Internal server error"}
     )
@@ -367,7 +531,7 @@ async def global_exception_handler(request, exc):
 async def http_exception_handler(request, exc):
     """HTTP exception handler"""
     logger.warning("HTTP exception", status_code=exc.status_code, detail=exc.detail, path=request.url.path)
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
         content={"detail": exc.detail}
     )
@@ -379,5 +543,7 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=int(os.getenv("PORT", 8001)),
         reload=settings.ENVIRONMENT == "development",
-        log_level="info"
+        log_level="info",
+        loop="uvloop",
+        http="httptools"
     ) 
\ No newline at end of file
@@ -218,6 +218,15 @@ CREATE TABLE IF NOT EXISTS analytics_events (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Create body measurements table
+CREATE TABLE IF NOT EXISTS body_measurements (
+    id UUID PRIMARY KEY,
+    image_url TEXT,
+    measurements JSONB NOT NULL,
+    confidence_score REAL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
 CREATE INDEX IF NOT EXISTS idx_users_email_verification_token ON users(email_verification_token);